@@ -0,0 +1 @@
+# Local stand-in for the gilligan share, see bench/README.md.
@@ -0,0 +1,2 @@
+# Stand-in for gilligan.thurston with the API used by the eclipse scripts and
+# tunable synthetic costs, see fakecost.py.
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+# Common parts of the stand-in sims and geometry.
+
+import gilligan.thurston.fakecost as fakecost
+
+
+class Node(object):
+    def __init__(self, label):
+        self.label = label
+        self.parms = dict()
+        self.verbose = False
+        self.visible = True
+        self.material = None
+        self.data_object = None
+
+    def set(self, parm, value):
+        self.parms[parm] = value
+
+    def get(self, parm):
+        return self.parms.get(parm)
+
+    def generate_object(self):
+        self.data_object = {'label': self.label, 'time': 0.0}
+
+    def reset_object(self):
+        pass
+
+    def print_parameters(self):
+        for parm in sorted(self.parms):
+            print self.label, parm, self.parms[parm]
+
+
+class Sim(Node):
+    generate_cost = 'wave_generate'
+    update_cost = 'wave_update'
+
+    def megapixels(self):
+        return fakecost.Megapixels(self.get('patchnxny') or [512, 512])
+
+    def generate_object(self):
+        fakecost.Spend(fakecost.COSTS[self.generate_cost] * self.megapixels())
+        self.data_object = {'label': self.label, 'time': 0.0}
+
+    def update(self, dt):
+        fakecost.Spend(fakecost.COSTS[self.update_cost] * self.megapixels())
+        self.data_object['time'] += dt
+
+    def write_displacement(self, path):
+        megapixels = self.megapixels()
+        fakecost.Spend(fakecost.COSTS['write'] * megapixels)
+        fakecost.WriteBytes(path, int(fakecost.COSTS['write_bytes_per_pixel'] * megapixels * (1 << 20)))
@@ -0,0 +1,18 @@
+#!/usr/bin/python
+
+import gilligan.thurston.fakecost as fakecost
+from gilligan.thurston.base import Node
+
+
+class Camera(Node):
+    pass
+
+
+class Image(Node):
+    pass
+
+
+def write_image_with_metadata(image):
+    path = image.get('imagename')
+    if path:
+        fakecost.WriteBytes(path, image.get('width') * image.get('height') * 16)
@@ -0,0 +1,8 @@
+color_black = '\033[30m'
+color_red = '\033[31m'
+color_green = '\033[32m'
+color_yellow = '\033[33m'
+color_blue = '\033[34m'
+color_magenta = '\033[35m'
+color_cyan = '\033[36m'
+color_white = '\033[37m'
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+# Synthetic costs of the gilligan stand-in.
+#
+# Defaults can be overridden with a json dict in FAKEGILLIGAN_COSTS, e.g.
+#
+#     FAKEGILLIGAN_COSTS='{"ewave_update": 0.05, "compute": "sleep"}'
+#
+# Sim costs are seconds per megapixel of patchnxny, so the relative cost of the
+# swell, small wave and eWave patches follows the real sims. compute "spin" burns
+# cpu holding the GIL, "sleep" stands for native code that releases it.
+
+import os
+import json
+import time
+
+COSTS = {'compute': 'spin',
+         # WaveSurferSim generate_object / update, seconds per megapixel
+         'wave_generate': 0.2,
+         'wave_update': 0.01,
+         # eWaveSim update, seconds per megapixel and update
+         'ewave_update': 0.04,
+         # WaveMerge update, seconds per update
+         'merge_update': 0.001,
+         # obj parse, seconds per MB of obj
+         'obj_load': 0.05,
+         # write_displacement, seconds per megapixel and bytes written per pixel
+         'write': 0.01,
+         'write_bytes_per_pixel': 0.25,
+         # render_scene, seconds per frame
+         'render': 0.5}
+COSTS.update(json.loads(os.environ.get('FAKEGILLIGAN_COSTS', '{}')))
+
+
+def Spend(seconds):
+    if seconds <= 0.0:
+        return
+    if COSTS['compute'] == 'sleep':
+        time.sleep(seconds)
+        return
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def Megapixels(nxny):
+    if isinstance(nxny, basestring):
+        nxny = json.loads(nxny)
+    return nxny[0] * nxny[1] / float(1 << 20)
+
+
+def WriteBytes(path, num):
+    with open(path, 'wb') as outfile:
+        block = '\0' * min(num, 1 << 20)
+        while num > 0:
+            outfile.write(block[:num])
+            num -= len(block)
@@ -0,0 +1,21 @@
+#!/usr/bin/python
+
+# frange lists like 5-26:3,75-100
+
+
+class Frange(object):
+    def __init__(self, frange):
+        frames = set()
+        for part in str(frange).split(','):
+            step = 1
+            if ':' in part:
+                part, step = part.split(':')
+                step = int(step)
+            if '-' in part.lstrip('-'):
+                first, last = part.split('-', 1)
+            else:
+                first = last = part
+            frames.update(xrange(int(first), int(last) + 1, step))
+        self.frames = sorted(frames)
+        self.start = self.frames[0]
+        self.end = self.frames[-1]
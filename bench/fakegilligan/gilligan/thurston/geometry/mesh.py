@@ -0,0 +1,7 @@
+#!/usr/bin/python
+
+from gilligan.thurston.base import Node
+
+
+class Mesh(Node):
+    pass
@@ -0,0 +1,19 @@
+#!/usr/bin/python
+
+import os
+
+import gilligan.thurston.fakecost as fakecost
+from gilligan.thurston.base import Node
+
+
+class Polygonal(Node):
+    def generate_object(self):
+        # parse cost follows the obj size, the obj is really read
+        path = self.get('objpath')
+        with open(path) as objfile:
+            data = objfile.read()
+        fakecost.Spend(fakecost.COSTS['obj_load'] * len(data) / float(1 << 20))
+        self.data_object = {'label': self.label, 'objpath': path, 'lines': data.count('\n')}
+
+    def info(self):
+        return {'centerOfMass': [0.0, 0.0, 0.0]}
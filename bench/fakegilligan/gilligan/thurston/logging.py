@@ -0,0 +1,18 @@
+#!/usr/bin/python
+
+import sys
+import time
+
+job_start = [0.0]
+
+
+def LogIt(source, message):
+    sys.stdout.write('{}: {}\n'.format(source, message))
+
+
+def beginJob():
+    job_start[0] = time.time()
+
+
+def endJob():
+    LogIt(__file__, 'job time {:.2f}s'.format(time.time() - job_start[0]))
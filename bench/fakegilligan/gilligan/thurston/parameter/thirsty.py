@@ -0,0 +1,3 @@
+# global frame and frame rate of the gilligan expressions
+F = 1
+FPS = 24.0
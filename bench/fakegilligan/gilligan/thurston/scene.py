@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+from gilligan.thurston.base import Node
+
+
+class Scene(Node):
+    def __init__(self, label):
+        Node.__init__(self, label)
+        self.sims = []
+        self.geometry = []
+        self.cameras = []
+
+    def add_sim(self, sim):
+        self.sims.append(sim)
+
+    def get_sim(self, label):
+        for sim in self.sims:
+            if sim.label == label:
+                return sim
+        return None
+
+    def add_geometry(self, geometry):
+        self.geometry.append(geometry)
+
+    def add_camera(self, camera):
+        self.cameras.append(camera)
+
+    def get_camera(self, label):
+        for camera in self.cameras:
+            if camera.label == label:
+                return camera
+        return None
+
+    def clear(self):
+        self.geometry = []
+        self.cameras = []
@@ -0,0 +1,8 @@
+#!/usr/bin/python
+
+from gilligan.thurston.base import Sim
+
+
+class eWaveSim(Sim):
+    generate_cost = 'wave_update'
+    update_cost = 'ewave_update'
@@ -0,0 +1 @@
+# registers the sim updates in the real gilligan, nothing to do here
@@ -0,0 +1,23 @@
+#!/usr/bin/python
+
+import gilligan.thurston.fakecost as fakecost
+from gilligan.thurston.base import Sim
+
+
+class WaveMerge(Sim):
+    def __init__(self, label):
+        Sim.__init__(self, label)
+        self.waves = []
+
+    def add_wave(self, wave):
+        self.waves.append(wave)
+
+    def generate_object(self):
+        self.data_object = {'label': self.label, 'time': 0.0}
+
+    def update(self, dt):
+        # the merge steps its waves, like the real WaveMerge
+        fakecost.Spend(fakecost.COSTS['merge_update'])
+        for wave in self.waves:
+            wave.update(dt)
+        self.data_object['time'] += dt
@@ -0,0 +1,7 @@
+#!/usr/bin/python
+
+from gilligan.thurston.base import Sim
+
+
+class WaveMesh(Sim):
+    pass
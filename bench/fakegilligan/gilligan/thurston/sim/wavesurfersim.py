@@ -0,0 +1,7 @@
+#!/usr/bin/python
+
+from gilligan.thurston.base import Sim
+
+
+class WaveSurferSim(Sim):
+    pass
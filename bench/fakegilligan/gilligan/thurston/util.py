@@ -0,0 +1,5 @@
+#!/usr/bin/python
+
+
+def formattedFrame(f):
+    return '{:04}'.format(int(f))
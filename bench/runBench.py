@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Benchmark of the eclipse scripts against the local gilligan stand-in.
+#
+# Every benchmark runs the real script in a subprocess with bench/fakegilligan
+# first on PYTHONPATH, in a scratch folder with a synthetic water thing and parms.
+# Sim scripts report frames/sec and the per stage time per frame from their
+# *_timing.jsonl, job generators report submitted tasks/sec. The /DPA paths of
+# the generators are pointed at the scratch folder and cqsubmittask is a stub
+# that only counts submissions.
+#
+# Usage from the command line:
+#
+#     ./runBench.py -f 1-24 -only waveShape waveShape_floating -out bench.json
+#     FAKEGILLIGAN_COSTS='{"ewave_update": 0.1}' ./runBench.py
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCHPATH = os.path.dirname(os.path.abspath(__file__))
+REPOPATH = os.path.dirname(BENCHPATH)
+FAKEPATH = os.path.join(BENCHPATH, 'fakegilligan')
+GILLIGANPATH = os.path.join(REPOPATH, 'gilligan')
+
+WAVE_PARMS = {'swell_waves': {'travel': 3.0, 'cuspscale': 3.0, 'depth': 10.0, 'longest': 1000.0,
+                              'typicalheight': 0.5405405405405405, 'align': 8.0, 'shortest': 4.0},
+              'pm_waves': {}}
+# module constants of the generators pointed at the scratch folder
+PATH_CONSTANTS = ['MAYAFILE', 'NUKEFILE', 'OUTPUTPATH', 'PARMSPATH', 'WAVESCRIPT', 'DISPLACEMENTSCRIPT']
+
+
+def WriteWaterThing(prefix, frames, verts):
+    # a rippling grid, same topology on every frame like the maya exports
+    side = max(2, int(verts ** 0.5))
+    triangles = []
+    for j in xrange(side - 1):
+        for i in xrange(side - 1):
+            v = j * side + i
+            triangles.extend([v, v + 1, v + side, v + 1, v + side + 1, v + side])
+    for f in frames:
+        positions = []
+        for j in xrange(side):
+            for i in xrange(side):
+                positions.extend([i * 0.01, 0.01 * ((i + j + f) % 7), j * 0.01])
+        lines = ['v {} {} {}\n'.format(*positions[i:i + 3]) for i in xrange(0, len(positions), 3)]
+        lines.extend('f {} {} {}\n'.format(triangles[i] + 1, triangles[i + 1] + 1, triangles[i + 2] + 1)
+                     for i in xrange(0, len(triangles), 3))
+        with open('{prefix}.{f:04}.obj'.format(prefix=prefix, f=f), 'w') as objfile:
+            objfile.writelines(lines)
+
+
+def Environment(scratch, submit_latency=0.0):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([FAKEPATH, GILLIGANPATH] + filter(None, [env.get('PYTHONPATH')]))
+    # stub submitter, one line per submitted task
+    bin_dir = os.path.join(scratch, 'bin')
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    stub = os.path.join(bin_dir, 'cqsubmittask')
+    with open(stub, 'w') as stubfile:
+        stubfile.write('#!/bin/bash\n')
+        if submit_latency > 0.0:
+            stubfile.write('sleep {}\n'.format(submit_latency))
+        stubfile.write('echo "$@" >> {log}\n'.format(log=os.path.join(scratch, 'submitted.log')))
+    os.chmod(stub, 0755)
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    return env
+
+
+def Run(command, env, log_path):
+    start = time.time()
+    with open(log_path, 'w') as logfile:
+        code = subprocess.call(command, env=env, stdout=logfile, stderr=subprocess.STDOUT)
+    wall = time.time() - start
+    if code != 0:
+        raise RuntimeError("{cmd} failed with {code}, see {log}".format(cmd=' '.join(command), code=code, log=log_path))
+    return wall
+
+
+def StageSummary(timing_paths):
+    stages = dict()
+    for timing_path in timing_paths:
+        with open(timing_path) as jsonfile:
+            for line in jsonfile:
+                record = json.loads(line)
+                for name, stage in record.get('summary', {}).items():
+                    total = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'count': 0, 'peak_rss_mb': 0.0})
+                    total['wall'] += stage['wall']
+                    total['cpu'] += stage['cpu']
+                    total['count'] += stage['count']
+                    total['peak_rss_mb'] = max(total['peak_rss_mb'], stage['peak_rss_mb'])
+    return stages
+
+
+def SimBenchmark(name, args, frange, scratch, python):
+    import gilligan.thurston.frange as frange_module
+    frames = frange_module.Frange(frange).frames
+    products = os.path.join(scratch, name, 'products')
+    os.makedirs(os.path.join(products, 'sim'))
+
+    thing = os.path.join(scratch, 'thing', 'bench_thing')
+    parms_path = os.path.join(scratch, 'bench_parms.json')
+    script = os.path.join(GILLIGANPATH, name + '.py')
+    common = ['-pn', 'bench', '-pp', products, '-p', parms_path, '-f', frange]
+    if name == 'waveShape_floating':
+        command = [python, script, '-w', thing] + common
+    else:
+        command = [python, script, '-wn', 'bench_thing', '-ap', os.path.dirname(thing)] + common
+
+    wall = Run(command + args, Environment(scratch), os.path.join(scratch, name + '.log'))
+    stages = StageSummary(glob.glob(os.path.join(products, 'sim', '*timing*.jsonl')))
+    return {'name': name, 'wall': wall, 'frames': len(frames), 'fps': len(frames) / wall, 'stages': stages}
+
+
+def GeneratorBenchmark(name, args, scratch, python, submit_latency=0.0):
+    # copy of the generator with its /DPA paths moved into the scratch folder
+    out_dir = os.path.join(scratch, name)
+    os.makedirs(out_dir)
+    source_path = os.path.join(REPOPATH, name + '.py')
+    with open(source_path) as sourcefile:
+        source = sourcefile.read()
+    for constant in PATH_CONSTANTS:
+        source = re.sub(r"^{} = .*$".format(constant),
+                        "{} = {!r}".format(constant, os.path.join(out_dir, constant.lower())), source, flags=re.M)
+    os.makedirs(os.path.join(out_dir, 'outputpath'))
+    # placeholder scenes, the submitters digest them
+    for constant in ['MAYAFILE', 'NUKEFILE']:
+        open(os.path.join(out_dir, constant.lower()), 'w').close()
+    script = os.path.join(out_dir, os.path.basename(source_path))
+    with open(script, 'w') as scriptfile:
+        scriptfile.write(source)
+
+    submitted_log = os.path.join(scratch, 'submitted.log')
+    if os.path.isfile(submitted_log):
+        os.remove(submitted_log)
+    env = Environment(scratch, submit_latency)
+    # helper modules next to the original generator
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(source_path), env['PYTHONPATH']])
+    wall = Run([python, script] + args, env, os.path.join(scratch, os.path.basename(name) + '.log'))
+    tasks = 0
+    if os.path.isfile(submitted_log):
+        with open(submitted_log) as logfile:
+            tasks = len(logfile.readlines())
+    return {'name': name, 'wall': wall, 'tasks': tasks, 'tasks_per_sec': tasks / wall}
+
+
+BENCHMARKS = [('waveShape', 'sim', []),
+              ('waveShape_floating', 'sim', []),
+              ('waveShape_displacement', 'sim', []),
+              ('gilligan/waveShape_swell_wedge', 'generator', ['-sampler', 'lhs', '-jobs', '32']),
+              ('maya/exportFrameWetMap', 'generator', []),
+              ('maya/exportDisplacementMesh', 'generator', []),
+              ('nuke/exportMultWetMap', 'generator', [])]
+
+
+def PrintReport(results):
+    print '{:<36}{:>10}{:>10}{:>14}'.format('benchmark', 'wall s', 'frames', 'frames/s')
+    for result in results:
+        if 'fps' in result:
+            print '{:<36}{:>10.2f}{:>10}{:>14.2f}'.format(result['name'], result['wall'], result['frames'], result['fps'])
+            for stage, record in sorted(result['stages'].items(), key=lambda item: -item[1]['wall']):
+                print '    {:<32}{:>10.2f}{:>10}{:>14.4f} s/frame'.format(stage, record['wall'], record['count'],
+                                                                          record['wall'] / result['frames'])
+        else:
+            print '{:<36}{:>10.2f}{:>10}{:>14.2f} tasks/s'.format(result['name'], result['wall'], result['tasks'],
+                                                                  result['tasks_per_sec'])
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser(description="Benchmark the eclipse scripts with the gilligan stand-in.")
+    parser.add_argument('-f', '--frange', type=str, dest='f', help='Frange of the sim benchmarks.', default='1-24')
+    parser.add_argument('-only', type=str, dest='only', nargs='+', default=[],
+                        help='Benchmarks to run, by script name: {}'.format(
+                            ' '.join(os.path.basename(name) for name, kind, args in BENCHMARKS)))
+    parser.add_argument('-args', type=str, dest='args', default='',
+                        help='Extra arguments for the sim scripts, e.g. "-writers 0".')
+    parser.add_argument('-objverts', type=int, dest='objverts', help='Vertices of the synthetic water thing.',
+                        default=20000)
+    parser.add_argument('-python', type=str, dest='python', help='Interpreter of the scripts.', default=sys.executable)
+    parser.add_argument('-out', type=str, dest='out', help='Write the results as json.', default='')
+    parser.add_argument('-submitlatency', type=float, dest='submitlatency', default=0.0,
+                        help='Seconds the cqsubmittask stub takes, like a round trip to the queue server.')
+    parser.add_argument('-keep', dest='keep', action='store_true', default=False, help='Keep the scratch folder.')
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argvs()
+    sys.path.insert(0, FAKEPATH)
+    import gilligan.thurston.frange as frange
+    last_frame = frange.Frange(args.f).end
+
+    scratch = tempfile.mkdtemp(prefix='eclipse_bench_')
+    print "Scratch folder: ", scratch
+    os.makedirs(os.path.join(scratch, 'thing'))
+    WriteWaterThing(os.path.join(scratch, 'thing', 'bench_thing'), xrange(1, last_frame + 2), args.objverts)
+    with open(os.path.join(scratch, 'bench_parms.json'), 'w') as jsonfile:
+        json.dump(WAVE_PARMS, jsonfile)
+
+    results = []
+    try:
+        for name, kind, bench_args in BENCHMARKS:
+            if args.only and os.path.basename(name) not in args.only:
+                continue
+            print "Benchmark {}...".format(name)
+            if kind == 'sim':
+                results.append(SimBenchmark(name, bench_args + args.args.split(), args.f, scratch, args.python))
+            else:
+                results.append(GeneratorBenchmark(name, bench_args, scratch, args.python, args.submitlatency))
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print '-' * 100
+    PrintReport(results)
+    if args.out:
+        with open(args.out, 'w') as jsonfile:
+            json.dump({'frange': args.f, 'costs': os.environ.get('FAKEGILLIGAN_COSTS', ''), 'results': results},
+                      jsonfile, indent=1)
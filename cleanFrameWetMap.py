@@ -1,21 +1,213 @@
 #!/usr/bin/env python
 
+# Promote the render to texture frames of an exportFrameWetMap.py run.
+#
+#     cleanFrameWetMap.py <export folder> [frames]
+#
+# products/tmp_NNNN/<name>.exr of each frame becomes products/<name>.NNNN.exr. The
+# frames are hardlinked on a pool of threads, no copy of the EXR on the same
+# filesystem, copied only across filesystems. The tmp folders are removed once every
+# promoted frame has the size of its render, a failed frame keeps the whole tmp tree.
+# The maya task checksums the tmp folder of a frame for its manifest record (see
+# maya/exportManifest.py), so the folder of a frame with a pending record is kept
+# until the record exists. The record is then pointed at the promoted EXR, so an
+# incremental export still finds the frame.
+#
+#     cleanFrameWetMap.py <export folder> -watch -count 120
+#
+# runs next to the maya tasks instead of after the last one: every frame is promoted
+# once its render has stopped changing, so the nuke multiply can start on the early
+# frames. The folders are polled, more slowly while nothing lands, until count frames
+# are promoted (the given frames when frames are given) and recorded.
+
 import os
 import sys
+import time
+import shutil
+import argparse
+from multiprocessing.pool import ThreadPool
+
+# shared helpers of the eclipse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gilligan'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maya'))
+from asyncWriter import LinkFile
+import exportManifest
+
+# seconds between polls of the watch, doubled while nothing lands
+WAITMIN = 1.0
+WAITMAX = 30.0
+# seconds a render has to stay unchanged to be complete
+STABLE = 2.0
+
+
+def TmpFolders(product_path, frames):
+    # frame id -> tmp folder, only the given frames if any
+    folders = dict()
+    if not os.path.isdir(product_path):
+        # the watch may start before the export folder is staged
+        return folders
+    for name in os.listdir(product_path):
+        if name.startswith('tmp_') and os.path.isdir(os.path.join(product_path, name)):
+            frame_id = name.split('_')[-1]
+            if not frames or frame_id in frames:
+                folders[frame_id] = os.path.join(product_path, name)
+    return folders
+
+
+def RenderPath(tmp_folder):
+    files = [name for name in os.listdir(tmp_folder) if not name.startswith('.')]
+    if not files:
+        raise IOError("No render in {}".format(tmp_folder))
+    return os.path.join(tmp_folder, files[0])
+
+
+def RenderStamp(tmp_folder):
+    # size and mtime of the render, None while there is none
+    try:
+        stat = os.stat(RenderPath(tmp_folder))
+    except (IOError, OSError):
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+def Promote(product_path, frame_id, tmp_folder, manifest_dir):
+    # path of the promoted frame, raises when it does not match its render
+    img_tmp_path = RenderPath(tmp_folder)
+    img_name = os.path.basename(img_tmp_path).split('.')[-2]
+    img_path = os.path.join(product_path, '{name}.{f}.exr'.format(name=img_name, f=frame_id))
+    # promoted by an earlier run, rename does nothing onto a link of the same file
+    if not (os.path.exists(img_path) and os.path.samefile(img_tmp_path, img_path)):
+        LinkFile(img_tmp_path, img_path, copy=True)
+    size = os.path.getsize(img_tmp_path)
+    if size == 0 or os.path.getsize(img_path) != size:
+        raise IOError("{} does not match its render {}".format(img_path, img_tmp_path))
+    return img_path
+
+
+def Recorded(manifest_dir, frame_id):
+    # no pending record, the maya task is done with the tmp folder
+    return not os.path.isfile(exportManifest.PendingPath(manifest_dir, int(frame_id)))
+
+
+def Release(manifest_dir, frame_id, tmp_folder, img_path):
+    # point the record at the promoted frame, then remove the render
+    if os.path.isfile(exportManifest.RecordPath(manifest_dir, int(frame_id))):
+        exportManifest.Promoted(manifest_dir, int(frame_id), RenderPath(tmp_folder), img_path)
+    shutil.rmtree(tmp_folder)
+
+
+def Watch(product_path, frames, count, promote, recorded, timeout):
+    # frame id -> tmp folder and promoted path, once count frames are promoted and recorded
+    promoted = dict()
+    stamps = dict()
+    waiting = set()
+    wait = WAITMIN
+    last_change = time.time()
+    while True:
+        changed = False
+        stable = []
+        for frame_id, tmp_folder in TmpFolders(product_path, frames).items():
+            if frame_id in promoted:
+                continue
+            stamp = RenderStamp(tmp_folder)
+            if stamp is None:
+                continue
+            if stamp != stamps.get(frame_id):
+                stamps[frame_id] = stamp
+                changed = True
+            elif stamp[0] > 0 and time.time() - stamp[1] >= STABLE:
+                stable.append((frame_id, tmp_folder))
+
+        for frame_id, img_path, error in promote(sorted(stable)):
+            if error is None:
+                promoted[frame_id] = dict(stable)[frame_id], img_path
+                changed = True
+                print "\tframe {f} promoted, {n}/{count}".format(f=frame_id, n=len(promoted), count=count)
+            else:
+                # still written, tried again on the next poll
+                print "\tframe {f} not promoted yet: {err}".format(f=frame_id, err=error)
+
+        unrecorded = set(frame_id for frame_id in promoted if not recorded(frame_id))
+        if len(promoted) >= count and not unrecorded:
+            break
+        # a frame that keeps failing to promote counts toward the timeout
+        if changed or waiting - unrecorded:
+            last_change = time.time()
+            wait = WAITMIN
+        elif timeout > 0.0 and time.time() - last_change > timeout:
+            raise RuntimeError("Nothing changed for {:.0f}s, {} of {} frames promoted, {} not recorded".format(
+                timeout, len(promoted), count, len(unrecorded)))
+        else:
+            wait = min(wait * 2.0, WAITMAX)
+        waiting = unrecorded
+        time.sleep(wait)
+    return promoted
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser(description="Promote the wetmap frames of an export out of their tmp folders.")
+    parser.add_argument('folder', type=str, help='Export folder, relative to the current folder or absolute.')
+    parser.add_argument('frames', type=int, nargs='*', help='Only these frames, e.g. one frame from frameGraph.py.')
+    parser.add_argument('-threads', type=int, dest='threads', default=16, help='Frames promoted side by side.')
+    parser.add_argument('-watch', '--watch', action='store_true', dest='watch',
+                        help='Promote the frames as their renders land, while maya still renders.')
+    parser.add_argument('-count', type=int, dest='count', default=0,
+                        help='Frames the watch waits for, default the number of given frames.')
+    parser.add_argument('-timeout', type=float, dest='timeout', default=0.0,
+                        help='Give up the watch when no render changed for this many seconds, 0 to wait forever.')
+
+    args = parser.parse_args()
+    if args.watch and not (args.count or args.frames):
+        parser.error("-watch needs -count or the frames to wait for")
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argvs()
+    start = time.time()
+    frames = set('{:04}'.format(f) for f in args.frames)
+    product_path = os.path.join(os.getcwd(), args.folder, 'products')
+    manifest_dir = os.path.join(os.getcwd(), args.folder, 'manifest')
+    print "Clean product path: ", product_path, '...'
+
+    pool = ThreadPool(max(args.threads, 1))
 
-folder = sys.argv[1]
-product_path = os.path.join(os.getcwd(), folder, 'products')
-print "Clean product path: ", product_path, '...'
+    def PromoteFrame(frame):
+        frame_id, tmp_folder = frame
+        try:
+            return frame_id, Promote(product_path, frame_id, tmp_folder, manifest_dir), None
+        except (IOError, OSError) as e:
+            return frame_id, None, e
 
-for root, dir, files in os.walk(product_path, topdown=False):
-    # clean tmp file
-    if root == product_path:
-        os.system("rm -rf {}".format(os.path.join(product_path, 'tmp*')))
+    if args.watch:
+        count = args.count or len(frames)
+        print "Watch for {} frames...".format(count)
+        try:
+            promoted = Watch(product_path, frames, count, lambda stable: pool.map(PromoteFrame, stable),
+                             lambda frame_id: Recorded(manifest_dir, frame_id), args.timeout)
+        except RuntimeError as e:
+            pool.close()
+            sys.exit("{}, tmp folders kept.".format(e))
     else:
-        frame_id = root.split('/')[-1].split('_')[-1]
-        img_name = files[0].split('.')[-2]
-        img_tmp_path = os.path.join(root, files[0])
-        img_path = os.path.join(product_path, '{name}.{f}.exr'.format(name=img_name, f=frame_id))
-        os.system("cp {tmp} {new}".format(tmp=img_tmp_path, new=img_path))
+        folders = TmpFolders(product_path, frames)
+        promoted = dict()
+        failed = []
+        for frame_id, img_path, error in pool.imap_unordered(PromoteFrame, sorted(folders.items())):
+            if error is not None:
+                print "\tframe {f} failed: {err}".format(f=frame_id, err=error)
+                failed.append(frame_id)
+            else:
+                promoted[frame_id] = folders[frame_id], img_path
+        if failed:
+            pool.close()
+            sys.exit("{} of {} frames failed, tmp folders kept.".format(len(failed), len(folders)))
 
-print "Cleaning complete."
+    # every frame is in place, the renders of the recorded frames can go
+    unrecorded = sorted(frame_id for frame_id in promoted if not Recorded(manifest_dir, frame_id))
+    pool.map(lambda frame: Release(manifest_dir, frame[0], *frame[1]),
+             [frame for frame in promoted.items() if frame[0] not in unrecorded])
+    pool.close()
+    if unrecorded:
+        print "Frames {} not recorded yet, tmp folders kept, clean again once recorded.".format(', '.join(unrecorded))
+    print "Cleaning complete, {n} frames in {wall:.2f}s.".format(n=len(promoted), wall=time.time() - start)
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# Background writer for simulation products.
+#
+# write_displacement() is a method of the sim and reads its live buffers, so the
+# frame is first written to local scratch disk (the copy of the frame buffer) and
+# the slow move onto /DPA over NFS is handed to a pool of writer threads. The sim
+# only blocks when the bounded queue is full, and close() waits for the queue to
+# drain and raises if any product failed to land, abort() when the sim itself
+# failed. Products land under a temporary name and are renamed into place, so
+# readers never see a partial EXR.
+
+import os
+import shutil
+import tempfile
+import threading
+import Queue
+
+
+def LinkFile(path, link_path, copy=False):
+    # hardlink when possible, symlink or copy across filesystems, replacing any old product
+    tmp_path = '{}.{}.link'.format(link_path, os.getpid())
+    try:
+        os.link(path, tmp_path)
+    except OSError:
+        if copy:
+            shutil.copy2(path, tmp_path)
+        else:
+            os.symlink(os.path.abspath(path), tmp_path)
+    try:
+        os.rename(tmp_path, link_path)
+    except OSError:
+        # no stray link in the way of the next try
+        os.remove(tmp_path)
+        raise
+
+
+def LandFile(local_path, path, links=()):
+    part_path = '{}.{}.part'.format(path, os.getpid())
+    shutil.move(local_path, part_path)
+    os.rename(part_path, path)
+    for link_path in links:
+        LinkFile(path, link_path)
+
+
+class AsyncWriter(object):
+    def __init__(self, threads=2, maxqueue=8, scratch=None):
+        self.threads = threads
+        self.errors = []
+        self.lock = threading.Lock()
+        self.workers = []
+        self.count = 0
+        if self.threads <= 0:
+            return
+
+        self.scratch = tempfile.mkdtemp(prefix='waveShape_write_', dir=scratch)
+        self.queue = Queue.Queue(maxsize=maxqueue)
+        for i in xrange(self.threads):
+            worker = threading.Thread(target=self._work, name='exr_writer_{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                local_path, path, links = item
+                try:
+                    LandFile(local_path, path, links)
+                except (IOError, OSError) as e:
+                    with self.lock:
+                        self.errors.append((path, e))
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        with self.lock:
+            errors = list(self.errors)
+        if errors:
+            raise IOError("Failed to write {num} products, first {path}: {err}".format(num=len(errors),
+                                                                                      path=errors[0][0],
+                                                                                      err=errors[0][1]))
+
+    def write_displacement(self, wave_sim, path, links=()):
+        if self.threads <= 0:
+            # never rewrite a product in place, it may share its inode with a cache entry
+            local_path = os.path.join(os.path.dirname(path), '.{}.{}'.format(os.getpid(), os.path.basename(path)))
+            wave_sim.write_displacement(local_path)
+            LandFile(local_path, path, links)
+            return
+
+        # fail the job early instead of simulating frames nobody can write
+        self.check()
+        self.count += 1
+        local_path = os.path.join(self.scratch, '{num}_{name}'.format(num=self.count, name=os.path.basename(path)))
+        wave_sim.write_displacement(local_path)
+        self.queue.put((local_path, path, links))
+
+    def close(self):
+        if self.threads <= 0:
+            return
+
+        try:
+            for worker in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+        finally:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+        self.check()
+
+    def abort(self):
+        # after a failed sim: land the queued frames and clean the scratch, the
+        # sim error is the one to raise
+        try:
+            self.close()
+        except IOError as e:
+            print "AsyncWriter: {}".format(e)
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+
+# Content addressed cache of single sim component products.
+#
+# A component frame lives at <root>/<product>/<key>/<product>.NNNN.exr where the
+# key is oceanComponents.ComponentKey of the component parms. Jobs that share a
+# component (every swell wedge has the same small waves) link the cached frame
+# into their products instead of simulating and writing it again.
+
+import os
+
+from asyncWriter import LinkFile
+
+
+class ComponentCache(object):
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key, product, f):
+        return os.path.join(self.root, product, key, '{product}.{f:04}.exr'.format(product=product, f=f))
+
+    def complete(self, key, product, frame_list):
+        for f in frame_list:
+            if not os.path.isfile(self.path(key, product, f)):
+                return False
+        return True
+
+    def link(self, key, product, f, product_path):
+        LinkFile(self.path(key, product, f), product_path)
+
+    def prepare(self, key, product):
+        key_dir = os.path.dirname(self.path(key, product, 0))
+        if not os.path.isdir(key_dir):
+            try:
+                os.makedirs(key_dir)
+            except OSError:
+                # another wedge created it first
+                if not os.path.isdir(key_dir):
+                    raise
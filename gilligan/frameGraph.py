@@ -0,0 +1,301 @@
+#!/usr/bin/python
+
+# Frame streaming runner of the floating object pipeline.
+#
+# Every stage of a pipeline json is a node per frame, and frame N of a stage starts
+# as soon as frame N of the stages it comes after is done, instead of waiting for
+# the whole previous stage:
+#
+#     ./frameGraph.py parms/frameGraph/floating.json
+#
+# A stage is one of
+#   - files only ("outputs"): frames made outside the runner, e.g. the exportTriObj
+#     OBJs, a frame is done once its outputs exist.
+#   - "command": run per frame with {f} formatted in, at most "concurrency" frames
+#     of the stage at a time, done when the command exits 0 and the outputs exist,
+#     on the exit code alone for a stage without outputs. A failed frame is tried
+#     "retries" more times.
+#   - "stream": one process for the frames of the stage, for sims that step frame
+#     after frame like waveShape_floating.py, formatted with {start}, {end} and
+#     {frames}. It starts once its first frame is ready and has to wait for the
+#     inputs of the later frames itself (waveShape_floating.py -objwait). Each frame
+#     is done as its outputs land, outputs older than the stream do not count, so the
+#     next stage streams behind the sim. A failed stream is started again for the
+#     frames it did not finish.
+# Outputs may use {f} and glob patterns, e.g. "products/tmp_{f:04}/*.exr". All of
+# them may use {stage} and {root}, the eclipse checkout of the runner. Done frames are
+# marked in the "state" folder with the logs of the commands, a pipeline run again
+# resumes from the nodes it already finished, -reset to run everything again. A
+# marked frame whose outputs are gone, e.g. the tmp renders a clean stage removes,
+# stays done as long as the frame is done in every stage after it. A stage without
+# outputs has nothing to check, its frames resume only on the stages after them.
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import subprocess
+
+# seconds between checks of the running nodes and the outputs
+WAIT = 1.0
+# eclipse checkout, for the scripts of the stages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def ParseFrames(frames):
+    # "1-120", "1-10,15,20-24" or a list of frames
+    if isinstance(frames, list):
+        return sorted(set(int(f) for f in frames))
+    result = set()
+    for part in str(frames).split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            result.update(xrange(int(start), int(end) + 1))
+        elif part.strip():
+            result.add(int(part))
+    return sorted(result)
+
+
+def FormatFrames(frames):
+    # "1-10,15" of a sorted frame list
+    ranges = []
+    for f in frames:
+        if ranges and f == ranges[-1][1] + 1:
+            ranges[-1][1] = f
+        else:
+            ranges.append([f, f])
+    return ','.join(str(a) if a == b else '{}-{}'.format(a, b) for a, b in ranges)
+
+
+class Stage(object):
+    def __init__(self, settings, frames):
+        self.name = settings['name']
+        self.after = settings.get('after', [])
+        self.outputs = settings.get('outputs', [])
+        self.command = settings.get('command', '')
+        self.stream = settings.get('stream', '')
+        self.concurrency = max(settings.get('concurrency', 1), 1)
+        self.retries = settings.get('retries', 0)
+        self.frames = ParseFrames(settings['frames']) if 'frames' in settings else frames
+        self.done = set()
+        self.failed = set()
+        # tries of each frame, 'stream' for the stream
+        self.tries = dict()
+        # frame, or tuple of the frames of the stream -> Popen
+        self.running = dict()
+        # tuple of the frames of the stream -> start time
+        self.started = dict()
+
+    def format(self, template, **values):
+        return template.format(stage=self.name, root=ROOT, **values)
+
+    def landed(self, f, since=0.0):
+        # outputs modified since, a second of slack for the mtimes of NFS servers
+        for path in self.outputs:
+            if not any(os.path.getmtime(match) >= since - 1.0 for match in glob.glob(self.format(path, f=f))):
+                return False
+        return True
+
+
+class FrameGraph(object):
+    def __init__(self, pipeline, state_dir):
+        frames = ParseFrames(pipeline['frames'])
+        self.stages = [Stage(settings, frames) for settings in pipeline['stages']]
+        self.by_name = dict((stage.name, stage) for stage in self.stages)
+        for stage in self.stages:
+            for name in stage.after:
+                if name not in self.by_name or self.stages.index(self.by_name[name]) >= self.stages.index(stage):
+                    raise ValueError("Stage {} comes after {}, which is not an earlier stage".format(stage.name, name))
+        self.state_dir = state_dir
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+
+    def marker_path(self, stage, f):
+        return os.path.join(self.state_dir, '{stage}.{f:04}.done'.format(stage=stage.name, f=f))
+
+    def log_path(self, stage, f):
+        return os.path.join(self.state_dir, '{stage}.{f:04}.log'.format(stage=stage.name, f=f))
+
+    def resume(self):
+        # done frames of an earlier run, with their outputs still there or done in
+        # every stage after them, later stages first
+        resumed = 0
+        for stage in reversed(self.stages):
+            later = [other for other in self.stages if stage.name in other.after]
+            for f in stage.frames:
+                if not os.path.exists(self.marker_path(stage, f)):
+                    continue
+                consumers = [other for other in later if f in other.frames]
+                if (stage.outputs and stage.landed(f)) or (consumers and all(f in other.done for other in consumers)):
+                    stage.done.add(f)
+                    resumed += 1
+        return resumed
+
+    def reset(self):
+        for name in os.listdir(self.state_dir):
+            if name.endswith('.done'):
+                os.remove(os.path.join(self.state_dir, name))
+
+    def finish(self, stage, f):
+        stage.done.add(f)
+        open(self.marker_path(stage, f), 'w').close()
+
+    def ready(self, stage, f):
+        # frames outside an upstream stage's range do not hold the stage back
+        for name in stage.after:
+            upstream = self.by_name[name]
+            if f in upstream.frames and f not in upstream.done:
+                return False
+        return True
+
+    def blocked(self, stage, f):
+        # an upstream frame failed, the frame can never run
+        for name in stage.after:
+            upstream = self.by_name[name]
+            if f in upstream.failed or self.blocked(upstream, f):
+                return True
+        return False
+
+    def start(self, stage, key, command, tries_key):
+        stage.tries[tries_key] = stage.tries.get(tries_key, 0) + 1
+        log_frame = key[0] if isinstance(key, tuple) else key
+        logfile = open(self.log_path(stage, log_frame), 'a' if stage.tries[tries_key] > 1 else 'w')
+        try:
+            stage.running[key] = subprocess.Popen(['bash', '-c', command], stdout=logfile, stderr=subprocess.STDOUT)
+        finally:
+            # the child has its own handle
+            logfile.close()
+        print "{stage}: start {what}".format(stage=stage.name,
+                                             what='frames ' + FormatFrames(key) if isinstance(key, tuple)
+                                             else 'frame {}'.format(key))
+
+    def step_command(self, stage):
+        for f, process in stage.running.items():
+            code = process.poll()
+            if code is None:
+                continue
+            del stage.running[f]
+            if code == 0 and stage.landed(f):
+                self.finish(stage, f)
+            elif stage.tries[f] <= stage.retries:
+                print "{stage}: frame {f} failed, exit {code}, try again".format(stage=stage.name, f=f, code=code)
+                self.start(stage, f, stage.format(stage.command, f=f), f)
+            else:
+                print "{stage}: frame {f} failed, exit {code}, see {log}".format(stage=stage.name, f=f, code=code,
+                                                                               log=self.log_path(stage, f))
+                stage.failed.add(f)
+
+        for f in stage.frames:
+            if len(stage.running) >= stage.concurrency:
+                break
+            if f in stage.done or f in stage.failed or f in stage.running or not self.ready(stage, f):
+                continue
+            self.start(stage, f, stage.format(stage.command, f=f), f)
+
+    def step_stream(self, stage):
+        for frames, process in stage.running.items():
+            code = process.poll()
+            # frames land while the stream runs
+            for f in frames:
+                if f not in stage.done and stage.landed(f, stage.started[frames]):
+                    self.finish(stage, f)
+            if code is None:
+                continue
+            del stage.running[frames]
+            del stage.started[frames]
+            missing = [f for f in frames if f not in stage.done]
+            if not missing:
+                continue
+            if stage.tries['stream'] > stage.retries:
+                print "{stage}: frames {frames} failed, exit {code}, see {log}".format(
+                    stage=stage.name, frames=FormatFrames(missing), code=code, log=self.log_path(stage, frames[0]))
+                stage.failed.update(missing)
+            else:
+                print "{stage}: stream exit {code} before frames {frames}, start again".format(
+                    stage=stage.name, code=code, frames=FormatFrames(missing))
+                self.start_stream(stage, missing)
+
+        if stage.running:
+            return
+        pending = [f for f in stage.frames if f not in stage.done and f not in stage.failed]
+        # the sim waits for the inputs of its later frames, the stream runs behind the stage before
+        if pending and self.ready(stage, pending[0]):
+            self.start_stream(stage, pending)
+
+    def start_stream(self, stage, frames):
+        # a stream restarts at its first missing frame, sims resume from their checkpoints
+        command = stage.format(stage.stream, start=frames[0], end=frames[-1], frames=FormatFrames(frames))
+        stage.started[tuple(frames)] = time.time()
+        self.start(stage, tuple(frames), command, 'stream')
+
+    def step(self):
+        for stage in self.stages:
+            if stage.command:
+                self.step_command(stage)
+            elif stage.stream:
+                self.step_stream(stage)
+            else:
+                for f in stage.frames:
+                    if f not in stage.done and stage.landed(f):
+                        self.finish(stage, f)
+
+    def waiting(self):
+        # frames that can still finish
+        for stage in self.stages:
+            if stage.running:
+                return True
+            for f in stage.frames:
+                if f not in stage.done and f not in stage.failed and not self.blocked(stage, f):
+                    return True
+        return False
+
+    def run(self):
+        start = time.time()
+        try:
+            while True:
+                self.step()
+                if not self.waiting():
+                    break
+                time.sleep(WAIT)
+        finally:
+            for stage in self.stages:
+                for process in stage.running.values():
+                    if process.poll() is None:
+                        process.terminate()
+        print '-' * 100
+        print "Pipeline finished in {:.1f}s.".format(time.time() - start)
+        ok = True
+        for stage in self.stages:
+            left = [f for f in stage.frames if f not in stage.done]
+            print "\t | {name:<16} {done:>5}/{total} frames done".format(name=stage.name, done=len(stage.done),
+                                                                         total=len(stage.frames))
+            if left:
+                ok = False
+                print "\t |\t not done: {}".format(FormatFrames(left))
+        return ok
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser(description="Run a pipeline frame by frame, stages stream behind each other.")
+    parser.add_argument('pipeline', type=str, help='Pipeline json.')
+    parser.add_argument('-state', type=str, dest='state', default='',
+                        help='Folder of the done frames and logs, default the "state" of the pipeline.')
+    parser.add_argument('-reset', action='store_true', dest='reset', help='Run every frame again.')
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argvs()
+    with open(args.pipeline) as jsonfile:
+        pipeline = json.load(jsonfile)
+    graph = FrameGraph(pipeline, args.state or pipeline['state'])
+    if args.reset:
+        graph.reset()
+    print "Resume {} done frames.".format(graph.resume())
+    if not graph.run():
+        sys.exit(1)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+# Staging of the farm job folders of the submitters.
+#
+# The MEL, shell and parms files of a submission are collected first and then
+# written in one pass: every folder is created once, files are written and their
+# permissions set in process, no mkdir/chmod shell per frame. The run manifest
+# <root>/run.json lists the folders, files and settings of the submission:
+#
+#     stage = jobStaging.Stage(parent_path)
+#     stage.dir(mel_dir)
+#     stage.script(shell_path, shell)
+#     stage.commit(frames=frames)
+
+import os
+import sys
+import json
+import time
+
+DIRMODE = 0770
+FILEMODE = 0660
+SCRIPTMODE = 0777
+
+
+class Stage(object):
+    def __init__(self, root):
+        self.root = root
+        self.dirs = [root]
+        self.files = []
+        self.start = time.time()
+
+    def dir(self, path):
+        if path not in self.dirs:
+            self.dirs.append(path)
+        return path
+
+    def file(self, path, content, mode=FILEMODE):
+        self.files.append((path, content, mode))
+        return path
+
+    def json(self, path, data, mode=FILEMODE):
+        return self.file(path, json.dumps(data, indent=1, sort_keys=True), mode)
+
+    def script(self, path, content):
+        return self.file(path, content, SCRIPTMODE)
+
+    def commit(self, **info):
+        created = []
+        # parents sort before their sub folders
+        for path in sorted(set(self.dirs + [os.path.dirname(path) for path, content, mode in self.files])):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+                created.append(path)
+        # only folders of this submission, umask does not apply to chmod
+        for path in created:
+            os.chmod(path, DIRMODE)
+        for path, content, mode in self.files:
+            with open(path, 'w') as stagefile:
+                stagefile.write(content)
+            os.chmod(path, mode)
+
+        seconds = time.time() - self.start
+        run = dict(info, script=os.path.abspath(sys.argv[0]), time=time.time(), staging_seconds=seconds,
+                   dirs=created, files=[path for path, content, mode in self.files])
+        run_path = os.path.join(self.root, 'run.json')
+        with open(run_path, 'w') as jsonfile:
+            json.dump(run, jsonfile, indent=1, sort_keys=True)
+        os.chmod(run_path, FILEMODE)
+        print "Staged {files} files in {dirs} new folders in {seconds:.2f}s.".format(
+            files=len(self.files), dirs=len(created), seconds=seconds)
+        return seconds
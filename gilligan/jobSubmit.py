@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+# Submission of the staged task scripts.
+#
+# The submitters hand all their scripts to one backend instead of blocking on a
+# cqsubmittask per frame:
+#
+#     backend = jobSubmit.Backend(QUEUE, BACKEND)
+#     backend.submit(script_paths)
+#
+# 'cq' runs the cqsubmittask calls side by side, at most concurrency at a time, and
+# retries failed submissions.
+# 'local' runs the scripts themselves on this machine, as many at a time as the cores
+# and the free memory allow, retrying failed tasks; the log of each task goes next to
+# its script. Both raise when a submission or a task still fails after its retries. ECLIPSE_SUBMIT=local runs any submitter locally without editing it.
+
+import os
+import time
+import shlex
+import Queue
+import threading
+import subprocess
+import multiprocessing
+
+# seconds between memory checks
+WAIT = 1.0
+
+
+def MemAvailable():
+    # GB of memory available for new processes, None when unknown
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / float(1 << 20)
+    except IOError:
+        pass
+    return None
+
+
+def RunAll(commands, slots, retries=0, can_start=None, logs=None):
+    # run commands (argument lists) on slots threads, each tried up to retries + 1 times,
+    # returns the exit code of the last try of each command
+    codes = [None] * len(commands)
+    pending = Queue.Queue()
+    for i in xrange(len(commands)):
+        pending.put(i)
+    running = [0]
+    lock = threading.Lock()
+
+    def Worker():
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            for attempt in xrange(retries + 1):
+                # wait for memory, unless nothing else runs; checked and counted in one
+                # step so workers never start on the same free memory
+                while True:
+                    with lock:
+                        if can_start is None or not running[0] or can_start():
+                            running[0] += 1
+                            break
+                    time.sleep(WAIT)
+                out = None
+                if logs is not None:
+                    out = open(logs[i], 'a' if attempt else 'w')
+                try:
+                    codes[i] = subprocess.call(commands[i], stdout=out, stderr=subprocess.STDOUT if out else None)
+                finally:
+                    if out is not None:
+                        out.close()
+                    with lock:
+                        running[0] -= 1
+                if codes[i] == 0:
+                    break
+                if attempt < retries:
+                    print "Retry {cmd} ({n}/{retries}), exit {code}".format(cmd=' '.join(commands[i]), n=attempt + 1,
+                                                                          retries=retries, code=codes[i])
+
+    workers = [threading.Thread(target=Worker) for n in xrange(min(max(slots, 1), max(len(commands), 1)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        # join with a timeout keeps ctrl-c working
+        while worker.is_alive():
+            worker.join(WAIT)
+    return codes
+
+
+class QueueBackend(object):
+    def __init__(self, queue, concurrency=8, retries=2, command='cqsubmittask {queue} {script}'):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.retries = retries
+        self.command = command
+
+    def submit(self, script_paths):
+        commands = [shlex.split(self.command.format(queue=self.queue, script=script_path))
+                    for script_path in script_paths]
+        for script_path in script_paths:
+            print "Submit task for script {}...".format(script_path)
+        codes = RunAll(commands, self.concurrency, self.retries)
+        failed = [command for command, code in zip(commands, codes) if code != 0]
+        if failed:
+            raise RuntimeError("{} of {} submissions failed: {}".format(len(failed), len(commands),
+                                                                       ' '.join(failed[0])))
+        return codes
+
+
+class LocalBackend(object):
+    def __init__(self, workers=0, cores_per_task=1, memory_gb=0.0, retries=0):
+        # cores_per_task 0 is a task that takes every core, like nuke without -m
+        if cores_per_task > 0:
+            self.workers = workers or max(multiprocessing.cpu_count() / cores_per_task, 1)
+        else:
+            self.workers = workers or 1
+        available = MemAvailable()
+        if memory_gb > 0.0 and available is not None:
+            # tasks just started have not taken their memory yet
+            self.workers = max(min(self.workers, int(available / memory_gb)), 1)
+        self.memory_gb = memory_gb
+        self.retries = retries
+
+    def can_start(self):
+        # start another task only while there is memory for it
+        available = MemAvailable()
+        return self.memory_gb <= 0.0 or available is None or available >= self.memory_gb
+
+    def submit(self, script_paths):
+        start = time.time()
+        print "Run {n} tasks locally, {workers} at a time...".format(n=len(script_paths), workers=self.workers)
+        commands = [['bash', script_path] for script_path in script_paths]
+        logs = ['{}.log'.format(os.path.splitext(script_path)[0]) for script_path in script_paths]
+        codes = RunAll(commands, self.workers, self.retries, self.can_start, logs)
+        failed = [log for log, code in zip(logs, codes) if code != 0]
+        print "Ran {n} tasks in {wall:.2f}s, {failed} failed.".format(n=len(script_paths), wall=time.time() - start,
+                                                                      failed=len(failed))
+        for log in failed:
+            print "\tfailed, see {}".format(log)
+        if failed:
+            raise RuntimeError("{} of {} local tasks failed, first {}".format(len(failed), len(script_paths), failed[0]))
+        return codes
+
+
+def Backend(queue, name='', retries=2, concurrency=8, cores_per_task=1, memory_gb=0.0):
+    # the backend of a submitter, ECLIPSE_SUBMIT overrides the name
+    name = os.environ.get('ECLIPSE_SUBMIT') or name or 'cq'
+    if name == 'local':
+        return LocalBackend(cores_per_task=cores_per_task, memory_gb=memory_gb, retries=retries)
+    if name == 'cq':
+        return QueueBackend(queue, concurrency=concurrency, retries=retries)
+    raise ValueError("Unknown submission backend {}".format(name))
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+# Lazy imports of the gilligan subsystems.
+#
+# The share is on NFS and farm tasks are short, so a script only pays for the
+# modules its run really touches. LazyImport returns a stand-in that imports the
+# module on first attribute access:
+#
+#     cam = lazyImport.LazyImport('gilligan.thurston.camera')
+#
+# Modules imported for their side effects are loaded with Load() once the run
+# knows it needs them. ProfileStartup(True) times every import of the process,
+# lazy ones included, and prints a report at exit:
+#
+#     ./waveShape.py ... --profile-startup
+
+import os
+import sys
+import time
+import atexit
+import __builtin__
+
+import_times = dict()
+import_stack = []
+process_start = time.time()
+builtin_import = __builtin__.__import__
+
+
+class LazyModule(object):
+    def __init__(self, name, optional=False):
+        self.__dict__['_name'] = name
+        self.__dict__['_optional'] = optional
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            name = self.__dict__['_name']
+            try:
+                __import__(name)
+            except ImportError:
+                if not self.__dict__['_optional']:
+                    raise
+                self.__dict__['_module'] = False
+                return False
+            module = sys.modules[name]
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        if module is False:
+            raise AttributeError("optional module {} is not available".format(self.__dict__['_name']))
+        return getattr(module, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __nonzero__(self):
+        # optional modules test false when they can not be imported
+        return self._load() is not False
+
+    def __repr__(self):
+        return '<lazy module {}>'.format(self.__dict__['_name'])
+
+
+def LazyImport(name, optional=False):
+    return LazyModule(name, optional)
+
+
+def Load(*modules):
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module._load()
+
+
+def TimedImport(name, globals=None, locals=None, fromlist=None, level=-1):
+    if name in sys.modules:
+        return builtin_import(name, globals, locals, fromlist, level)
+
+    start = time.time()
+    import_stack.append(0.0)
+    try:
+        return builtin_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        children = import_stack.pop()
+        record = import_times.setdefault(name, [0.0, 0.0])
+        record[0] += elapsed
+        record[1] += elapsed - children
+        if import_stack:
+            import_stack[-1] += elapsed
+
+
+def Report(out=sys.stderr, limit=30):
+    total = sum(own for cumulative, own in import_times.values())
+    out.write('{:<48}{:>12}{:>12}\n'.format('module', 'total s', 'self s'))
+    for name, (cumulative, own) in sorted(import_times.items(), key=lambda item: -item[1][1])[:limit]:
+        out.write('{:<48}{:>12.3f}{:>12.3f}\n'.format(name, cumulative, own))
+    out.write('{:<48}{:>12.3f}\n'.format('all imports ({} modules)'.format(len(import_times)), total))
+    out.write('{:<48}{:>12.3f}\n'.format('process', time.time() - process_start))
+
+
+def ProfileStartup(enabled):
+    if not enabled or __builtin__.__import__ is TimedImport:
+        return
+    __builtin__.__import__ = TimedImport
+    atexit.register(Report)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# Parameters of the swell and small wave WaveSurferSim components.
+#
+# Each component is described by an ordered list of (parm, value) pairs, so the
+# same description builds the sim and keys the component cache. Import after the
+# gilligan share is on sys.path.
+
+import json
+import hashlib
+import collections
+
+import lazyImport
+
+wssim = lazyImport.LazyImport('gilligan.thurston.sim.wavesurfersim')
+
+
+def SwellWaveParms(wave_parms, typicalheight_mult=1.0, cuspscale_mult=1.0):
+    swell = wave_parms.get('swell_waves')
+    # demo value: typicalheight 2.0/3.7, travel 3.0, align 8.0, cuspscale 0.75*4.0,
+    #             longest 1000.0, shortest 4.0, depth 10.0
+    return [('oceantype', 'str("ochi")'),
+            ('patchsize', '[ 4000.0, 4000.0 ]'),
+            ('patchnxny', '[ 2048, 2048 ]'),
+            ('typicalheight', swell.get('typicalheight') * typicalheight_mult),
+            ('travel', swell.get('travel')),
+            ('align', swell.get('align')),
+            ('direction', 90.0),
+            ('cuspscale', swell.get('cuspscale') * cuspscale_mult),
+            ('longest', swell.get('longest')),
+            ('shortest', swell.get('shortest')),
+            ('depth', swell.get('depth'))]
+
+
+def SmallWaveParms(wave_parms):
+    # pm_waves are not wedged, every job gets the same small waves
+    return [('oceantype', 'str("deep")'),
+            ('patchsize', '[ 30.0, 30.0 ]'),
+            ('patchnxny', '[ 1024, 1024 ]'),
+            ('typicalheight', 0.2),
+            ('direction', 0.0),
+            ('longest', 10.0),
+            ('shortest', 0.013),
+            ('cuspscale', 0.75*0.5)]
+            # ('cuspscale', '0.75*0.5*(thirsty.F-1.0)/3.0')
+
+
+# label, product name and parms of each component
+COMPONENTS = [('swell_waves', 'swell_wave', SwellWaveParms),
+              ('small_waves', 'small_wave', SmallWaveParms)]
+
+
+def CreateWave(label, parms):
+    wave = wssim.WaveSurferSim(label)
+    for parm, value in parms:
+        wave.set(parm, value)
+    wave.generate_object()
+
+    return wave
+
+
+def ComponentKey(label, parms, fps):
+    # frame f of a component is the closed form surface at f / fps
+    key = json.dumps({'label': label, 'parms': parms, 'fps': fps}, sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+
+class WavePool(object):
+    # initialised components kept between jobs of one process, a component is only
+    # generated again when its parms change. A long running process (waveShapeDaemon.py)
+    # keeps per_label parms sets of each component, least recently used dropped first.
+    def __init__(self, per_label=1):
+        self.per_label = per_label
+        self.waves = dict()
+        self.used = set()
+
+    def get(self, label, parms):
+        key = json.dumps(parms, sort_keys=True)
+        waves = self.waves.setdefault(label, collections.OrderedDict())
+        if key in waves:
+            wave, wave_time = waves.pop(key)
+            # closed form surface, step back to time zero for the next job
+            if wave_time != 0.0:
+                wave.update(-wave_time)
+        else:
+            wave = CreateWave(label, parms)
+        waves[key] = (wave, 0.0)
+        while len(waves) > max(self.per_label, 1):
+            waves.popitem(last=False)
+        self.used.add((label, key))
+
+        return wave
+
+    def release(self, wave_time):
+        # the job stepped every wave it got to wave_time
+        for label, key in self.used:
+            if key in self.waves[label]:
+                self.waves[label][key] = (self.waves[label][key][0], wave_time)
+        self.used = set()
+
+    def abandon(self):
+        # the job failed somewhere, the time of its waves is unknown
+        for label, key in self.used:
+            self.waves[label].pop(key, None)
+        self.used = set()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# Content addressed cache of whole job results.
+#
+# The key hashes the effective inputs of a job: parms json, cli scalars and the
+# digests of the water thing files. The frange is left out of the key on purpose,
+# frame N of a sim does not depend on which frames were requested, so the frames
+# of every run with the same inputs collect in one entry:
+#
+#     <root>/<key>/manifest.json
+#     <root>/<key>/<product>.NNNN.exr
+#
+# Products are hardlinked in and out of the entries, so a hit costs no copies and
+# evicting an entry never touches the products of a job. Entries are evicted least
+# recently used first once the cache is over its size cap. The cap counts the bytes
+# only the cache holds: a file still linked from a products folder stays on disk when
+# its entry goes, so entries that would free nothing are kept.
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+
+from asyncWriter import LinkFile
+
+
+def FileDigest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as digestfile:
+        for block in iter(lambda: digestfile.read(1 << 20), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def FilesDigest(pattern):
+    # one digest over every file of a sequence, independent of where it lives
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(pattern)):
+        digest.update('{} {}\n'.format(os.path.basename(path), FileDigest(path)))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, root, maxbytes):
+        self.root = root
+        self.maxbytes = maxbytes
+
+    def key(self, inputs):
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.root, key)
+
+    def fetch(self, key, products):
+        # products is a list of (cache name, product path), all or nothing
+        entry_dir = self.entry(key)
+        for name, product_path in products:
+            if not os.path.isfile(os.path.join(entry_dir, name)):
+                return False
+
+        for name, product_path in products:
+            LinkFile(os.path.join(entry_dir, name), product_path, copy=True)
+        # mark entry as recently used
+        os.utime(os.path.join(entry_dir, 'manifest.json'), None)
+
+        return True
+
+    def store(self, key, products, inputs):
+        entry_dir = self.entry(key)
+        if not os.path.isdir(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                if not os.path.isdir(entry_dir):
+                    raise
+
+        for name, product_path in products:
+            if os.path.isfile(product_path):
+                LinkFile(product_path, os.path.join(entry_dir, name), copy=True)
+
+        manifest = {'inputs': inputs, 'time': time.time(),
+                    'products': sorted(name for name in os.listdir(entry_dir) if name != 'manifest.json')}
+        tmp_path = os.path.join(entry_dir, 'manifest.json.{}'.format(os.getpid()))
+        with open(tmp_path, 'w') as jsonfile:
+            json.dump(manifest, jsonfile, indent=1)
+        os.rename(tmp_path, os.path.join(entry_dir, 'manifest.json'))
+
+        self.evict(keep=key)
+
+    def held_bytes(self, key):
+        # bytes evicting the entry frees
+        entry_dir = self.entry(key)
+        size = 0
+        for name in os.listdir(entry_dir):
+            stat = os.stat(os.path.join(entry_dir, name))
+            if name != 'manifest.json' and stat.st_nlink == 1:
+                size += stat.st_size
+        return size
+
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            entry_dir = self.entry(key)
+            manifest_path = os.path.join(entry_dir, 'manifest.json')
+            try:
+                size = self.held_bytes(key)
+                entries.append((os.path.getmtime(manifest_path), key, size))
+            except OSError:
+                # entry being written or evicted by another job
+                continue
+            total += size
+
+        for used, key, size in sorted(entries):
+            if total <= self.maxbytes:
+                break
+            if key == keep or size == 0:
+                continue
+            shutil.rmtree(self.entry(key), ignore_errors=True)
+            total -= size
@@ -68,26 +68,33 @@ import math
 
 # os.system('export LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/')
 sys.path.append('/DPA/wookie/dpa/projects/eclipse/share/')
+import lazyImport
+lazyImport.ProfileStartup('--profile-startup' in sys.argv)
+
 # os.environ['LD_LIBRARY_PATH'] = '/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/'
 
 # print os.environ['LD_LIBRARY_PATH']
 os.system('echo $LD_LIBRARY_PATH')
 
-import gilligan.thurston.scene as scene
-import gilligan.thurston.sim.ewavesim as ewsim
-import gilligan.thurston.sim.wavemesh as simmesh
-import gilligan.thurston.sim.wavemerge as simmerge
-import gilligan.thurston.sim.wavesurfersim as wssim
-import gilligan.thurston.sim.updates
-import gilligan.thurston.parameter.thirsty as thirsty
-import gilligan.thurston.parameter as param
-import gilligan.thurston.util as util
+# only the gilligan subsystems a run touches are loaded, see lazyImport.py
+scene = lazyImport.LazyImport('gilligan.thurston.scene')
+ewsim = lazyImport.LazyImport('gilligan.thurston.sim.ewavesim')
+simmesh = lazyImport.LazyImport('gilligan.thurston.sim.wavemesh')
+simmerge = lazyImport.LazyImport('gilligan.thurston.sim.wavemerge')
+wssim = lazyImport.LazyImport('gilligan.thurston.sim.wavesurfersim')
+updates = lazyImport.LazyImport('gilligan.thurston.sim.updates')
+thirsty = lazyImport.LazyImport('gilligan.thurston.parameter.thirsty')
+param = lazyImport.LazyImport('gilligan.thurston.parameter')
+util = lazyImport.LazyImport('gilligan.thurston.util')
 from gilligan.thurston.logging import LogIt, beginJob, endJob
-import gilligan.thurston.geometry.polygonal as poly
-import gilligan.thurston.geometry.mesh as gmesh
-import gilligan.thurston.camera as cam
+poly = lazyImport.LazyImport('gilligan.thurston.geometry.polygonal')
+gmesh = lazyImport.LazyImport('gilligan.thurston.geometry.mesh')
+cam = lazyImport.LazyImport('gilligan.thurston.camera')
 import gilligan.thurston.colors as colors
 
+from thingCache import ThingCache
+from stageTimer import StageTimer
+
 print "lalala"
 exit()
 
@@ -192,15 +199,28 @@ def CreateCamera(surface, view_object):
     return camera
 
 
-def RetrieveThingInWater(f):
-    thing_in_water_path = os.path.join(ASSPATH, '{name}.{frame}.obj'.format(name=ASSNANE, frame=util.formattedFrame(f)))
+def ThingInWaterPath(f):
+    return os.path.join(ASSPATH, '{name}.{frame}.obj'.format(name=ASSNANE, frame=util.formattedFrame(f)))
     # thing_in_water_path = "../assets/toysubmarine/model/products/geom/0001/obj/lo/toysubmarine." + util.formattedFrame(f) +".obj"
+
+
+def LoadThingInWater(thing_in_water_path):
     thing_in_water = poly.Polygonal('thing_in_water')
     thing_in_water.set('objpath', thing_in_water_path)
     thing_in_water.visible = False
+    # parse the obj now, possibly on the prefetch thread
+    thing_in_water.generate_object()
     return thing_in_water
 
 
+# the eWave source and the render of a frame share one loaded obj
+thing_cache = ThingCache(LoadThingInWater)
+
+
+def RetrieveThingInWater(f):
+    return thing_cache.get(ThingInWaterPath(f))
+
+
 #
 #######################################################################################
 #######################################################################################
@@ -214,6 +234,7 @@ def RetrieveThingInWater(f):
 
 
 beginJob()
+lazyImport.Load(updates)
 
 # thirsty.FPS = 30.0
 thirsty.FPS = 24.0
@@ -249,21 +270,28 @@ ew.set('surface_geom', merged_ocean)
 #
 
 frame_list = frame_range.frames
+timer = StageTimer("../products/ewave_sim/" + ew.label + "_timing.jsonl")
 
 for f in range(1,frame_range.end+1):
     LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
     thirsty.F = int(f)
     LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N\n" + colors.color_white)
-    merged_ocean.update(timestep)
-    water_thing = RetrieveThingInWater(f)
+    with timer.stage('ocean_update'):
+        merged_ocean.update(timestep)
+    with timer.stage('obj_load'):
+        water_thing = RetrieveThingInWater(f)
+    if f < frame_range.end:
+        thing_cache.prefetch(ThingInWaterPath(f + 1))
     ew.set('height_source_geom', water_thing)
     ew.set('compute_height_source', True)
-    ew.update(timestep)
+    with timer.stage('ewave_update'):
+        ew.update(timestep)
     LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N   F I N I S H E D\n" + colors.color_white)
     if f in frame_list:
         if ew.verbose:
             fname = "../products/ewave_sim/" + ew.label + "." + util.formattedFrame(f) + ".exr"
-            ew.write_displacement( fname )
+            with timer.stage('write_displacement'):
+                ew.write_displacement( fname )
 
 
 ###############################
@@ -484,8 +512,9 @@ for f in range(1,frame_range.end+1):
         viewdir[1] = viewdir[1]/viewdirmag
         LogIt(__file__, "oceanmesh view direction: " + str(viewdir) )
         oceanmesh.set('rangedirection', viewdir )
-        oceanmesh.generate_object()
-        oceanmesh.update(timestep)
+        with timer.stage('oceanmesh_update'):
+            oceanmesh.generate_object()
+            oceanmesh.update(timestep)
 
 
 # --------------------------------------------------
@@ -528,8 +557,11 @@ for f in range(1,frame_range.end+1):
         renderer.set('imagename', image_name)
         renderer.verbose = True
         renderer.generate_object()
-        if renderer.render_scene( renderscene, renderscene.get_camera('ocean_camera'), image):
-            cam.write_image_with_metadata( image)
+        with timer.stage('render'):
+            rendered = renderer.render_scene( renderscene, renderscene.get_camera('ocean_camera'), image)
+        if rendered:
+            with timer.stage('write_image'):
+                cam.write_image_with_metadata( image)
         else:
             LogIt(__file__,"Not writing image to disk")
 
@@ -541,4 +573,7 @@ for f in range(1,frame_range.end+1):
 
         LogIt(__file__, colors.color_yellow + "\n\n\tR E N D E R   F I N I S H E D\n" + colors.color_white)
 
+    timer.frame(f)
+
+timer.summary()
 endJob()
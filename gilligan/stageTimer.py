@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+# Per stage timing of the simulation loops.
+#
+# Every stage of a frame (ocean update, eWave substeps, obj load, product write)
+# records wall time, process cpu time and the peak rss of the process after the
+# stage. frame() appends one json line per frame to the timing file next to the
+# products, summary() prints the totals of the job and appends them as the last
+# line. Stages entered several times in a frame (substeps) are summed, with a count.
+
+import os
+import sys
+import json
+import time
+import resource
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def CpuTime():
+    # user + system time of the process, writer and prefetch threads included
+    times = os.times()
+    return times[0] + times[1]
+
+
+def PeakRss():
+    # MB, ru_maxrss is KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class StageTimer(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.jsonfile = None
+        if path is not None:
+            self.jsonfile = open(path, 'w')
+        self.frame_stages = OrderedDict()
+        self.totals = OrderedDict()
+        self.frames = 0
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.time()
+        cpu = CpuTime()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall
+            cpu = CpuTime() - cpu
+            rss = PeakRss()
+            for stages in [self.frame_stages, self.totals]:
+                record = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'count': 0, 'peak_rss_mb': 0.0})
+                record['wall'] += wall
+                record['cpu'] += cpu
+                record['count'] += 1
+                record['peak_rss_mb'] = max(record['peak_rss_mb'], rss)
+
+    def frame(self, f, **extra):
+        # extra values of the frame, like the substeps used, go into the record
+        if self.jsonfile is not None and self.frame_stages:
+            record = {'frame': f, 'time': time.time(), 'stages': self.frame_stages}
+            record.update(extra)
+            self.jsonfile.write(json.dumps(record) + '\n')
+            self.jsonfile.flush()
+        self.frame_stages = OrderedDict()
+        self.frames += 1
+
+    def summary(self, out=None):
+        # looked up per call, a warm worker redirects stdout to the job's client
+        out = out or sys.stdout
+        wall = time.time() - self.start
+        if self.jsonfile is not None:
+            self.jsonfile.write(json.dumps({'summary': self.totals, 'frames': self.frames, 'wall': wall,
+                                            'peak_rss_mb': PeakRss()}) + '\n')
+            self.jsonfile.close()
+            self.jsonfile = None
+
+        out.write('{:<24}{:>8}{:>12}{:>12}{:>12}{:>8}{:>12}\n'.format('stage', 'count', 'wall s', 'wall/frame',
+                                                                       'cpu s', 'wall%', 'peak MB'))
+        for name, record in self.totals.items():
+            out.write('{:<24}{:>8}{:>12.2f}{:>12.3f}{:>12.2f}{:>8.1f}{:>12.0f}\n'.format(
+                name, record['count'], record['wall'], record['wall'] / max(self.frames, 1),
+                record['cpu'], 100.0 * record['wall'] / max(wall, 1e-9), record['peak_rss_mb']))
+        out.write('{:<24}{:>8}{:>12.2f}\n'.format('job', self.frames, wall))
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+# LRU cache of loaded water thing geometry keyed by obj path and mtime.
+#
+# The loader builds and generates the gilligan geometry for one source, an obj
+# path by default, and stamp() returns its modification time. Frames
+# that reuse the same obj (clamped frames before simstart, the eWave source and
+# the render of the same frame) get the already parsed object back, and
+# prefetch() parses the next frame's obj on a background thread while the
+# current frame simulates. ReadPositions() gives the vertex positions of an obj
+# for the scripts that measure the motion of the water thing.
+
+import os
+import array
+import threading
+import collections
+
+import lazyImport
+
+# optional, vectorised obj vertex parsing
+numpy = lazyImport.LazyImport('numpy', optional=True)
+
+
+def ReadPositions(obj_path):
+    # vertex positions only; numpy parses all vertices in one call, array is the fallback
+    with open(obj_path) as objfile:
+        lines = [line[2:] for line in objfile if line.startswith('v ')]
+    if numpy:
+        positions = numpy.fromstring(''.join(lines), dtype=numpy.float32, sep=' ')
+        # 'v x y z w' or colours, one value per vertex too many
+        if len(positions) == 3 * len(lines):
+            return positions
+    positions = array.array('f')
+    for line in lines:
+        positions.extend(float(v) for v in line.split()[:3])
+    return positions
+
+
+class ThingCache(object):
+    def __init__(self, loader, maxsize=4, stamp=os.path.getmtime):
+        self.loader = loader
+        self.stamp = stamp
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+    def _key(self, path):
+        return path, self.stamp(path)
+
+    def _insert(self, key, thing):
+        with self.lock:
+            self.cache.pop(key, None)
+            self.cache[key] = thing
+            while len(self.cache) > max(self.maxsize, 1):
+                self.cache.popitem(last=False)
+
+    def _prefetch(self, key):
+        try:
+            self._insert(key, self.loader(key[0]))
+        except Exception:
+            # get() loads it again in the sim thread and reports the error there
+            pass
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def get(self, path):
+        if self.maxsize <= 0:
+            return self.loader(path)
+
+        key = self._key(path)
+        with self.lock:
+            pending = self.pending.get(key)
+        if pending is not None:
+            pending.join()
+
+        with self.lock:
+            thing = self.cache.pop(key, None)
+            if thing is not None:
+                # most recently used goes last
+                self.cache[key] = thing
+                return thing
+
+        thing = self.loader(path)
+        self._insert(key, thing)
+        return thing
+
+    def prefetch(self, path):
+        if self.maxsize <= 0:
+            return
+        try:
+            key = self._key(path)
+        except OSError:
+            return
+
+        with self.lock:
+            if key in self.cache or key in self.pending:
+                return
+            worker = threading.Thread(target=self._prefetch, args=(key,), name='thing_prefetch')
+            worker.daemon = True
+            self.pending[key] = worker
+            worker.start()
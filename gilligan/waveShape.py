@@ -68,24 +68,36 @@ import math
 import argparse
 import json
 
+import lazyImport
+lazyImport.ProfileStartup('--profile-startup' in sys.argv)
+
 # os.environ['LD_LIBRARY_PATH'] = ':/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/'
 sys.path.append('/DPA/wookie/dpa/projects/eclipse/share/')
 
-import gilligan.thurston.scene as scene
-import gilligan.thurston.sim.ewavesim as ewsim
-import gilligan.thurston.sim.wavemesh as simmesh
-import gilligan.thurston.sim.wavemerge as simmerge
-import gilligan.thurston.sim.wavesurfersim as wssim
-import gilligan.thurston.sim.updates
-import gilligan.thurston.parameter.thirsty as thirsty
-import gilligan.thurston.parameter as param
-import gilligan.thurston.util as util
+# only the gilligan subsystems a run touches are loaded, see lazyImport.py
+scene = lazyImport.LazyImport('gilligan.thurston.scene')
+ewsim = lazyImport.LazyImport('gilligan.thurston.sim.ewavesim')
+simmesh = lazyImport.LazyImport('gilligan.thurston.sim.wavemesh')
+simmerge = lazyImport.LazyImport('gilligan.thurston.sim.wavemerge')
+wssim = lazyImport.LazyImport('gilligan.thurston.sim.wavesurfersim')
+updates = lazyImport.LazyImport('gilligan.thurston.sim.updates')
+thirsty = lazyImport.LazyImport('gilligan.thurston.parameter.thirsty')
+param = lazyImport.LazyImport('gilligan.thurston.parameter')
+util = lazyImport.LazyImport('gilligan.thurston.util')
 from gilligan.thurston.logging import LogIt, beginJob, endJob
-import gilligan.thurston.geometry.polygonal as poly
-import gilligan.thurston.geometry.mesh as gmesh
-import gilligan.thurston.camera as cam
+poly = lazyImport.LazyImport('gilligan.thurston.geometry.polygonal')
+gmesh = lazyImport.LazyImport('gilligan.thurston.geometry.mesh')
+cam = lazyImport.LazyImport('gilligan.thurston.camera')
 import gilligan.thurston.colors as colors
 
+from asyncWriter import AsyncWriter
+from thingCache import ThingCache
+from componentCache import ComponentCache
+import oceanComponents
+from resultCache import ResultCache, FilesDigest
+from stageTimer import StageTimer
+import waveShapeDaemon
+
 
 # ------------------------ pre-setting -------------------------
 # ASSPATH = "/DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/testAss/"
@@ -97,48 +109,24 @@ ASSNANE = ""
 PRODNAME = ""
 PRODUCTSPATH = ""
 WRITEOBJ = True
+# background product writers
+WRITERTHREADS = 2
+WRITEQUEUE = 8
+# content addressed cache of swell/small wave frames shared between jobs
+COMPONENTCACHE = None
+# content addressed cache of whole job results
+RESULTCACHE = None
+# swell/small sims kept between the wedges of a batch
+WAVEPOOL = oceanComponents.WavePool()
 # -------------------------------------------------------
 
 
 def CreateWaterSims(name, wave_parms):
     simscene = scene.Scene(name)
 
-    swell_waves = wssim.WaveSurferSim('swell_waves')
-    swell_waves.set('oceantype', 'str("ochi")' )
-    swell_waves.set('patchsize', '[ 4000.0, 4000.0 ]' )
-    swell_waves.set('patchnxny', '[ 2048, 2048 ]' )
-    # swell_waves.set('typicalheight', 2.0/3.7 )
-    # swell_waves.set('travel', 3.0 )
-    # swell_waves.set('align', 8.0 )
-    # swell_waves.set('direction', 90.0 )
-    # swell_waves.set('cuspscale', 0.75*4.0 )
-    # swell_waves.set('longest', 1000.0 )
-    # swell_waves.set('shortest', 4.0 )
-    # swell_waves.set('depth', 10.0 )
-    swell_waves.set('typicalheight', wave_parms.get('swell_waves').get('typicalheight') )
-    swell_waves.set('travel', wave_parms.get('swell_waves').get('travel') )
-    swell_waves.set('align', wave_parms.get('swell_waves').get('align') )
-    swell_waves.set('direction', 90.0 )
-    swell_waves.set('cuspscale', wave_parms.get('swell_waves').get('cuspscale') )
-    swell_waves.set('longest', wave_parms.get('swell_waves').get('longest') )
-    swell_waves.set('shortest', wave_parms.get('swell_waves').get('shortest') )
-    swell_waves.set('depth', wave_parms.get('swell_waves').get('depth') )
-    swell_waves.generate_object()
-    simscene.add_sim(swell_waves)
-    
-    pm_waves =  wssim.WaveSurferSim('small_waves')
-    pm_waves.set('oceantype', 'str("deep")' )
-    pm_waves.set('patchsize', '[ 30.0, 30.0 ]' )
-    pm_waves.set('patchnxny', '[ 1024, 1024 ]' )
-    pm_waves.set('typicalheight', 0.2 )
-    pm_waves.set('direction', 0.0 )
-    pm_waves.set('longest',  10.0 )
-    pm_waves.set('shortest', 0.013 )
-    pm_waves.set('cuspscale',  0.75*0.5 )
-    # pm_waves.set('cuspscale',  '0.75*0.5*(thirsty.F-1.0)/3.0' )
-    pm_waves.generate_object()
-    simscene.add_sim(pm_waves)
-    
+    for label, product, parms in oceanComponents.COMPONENTS:
+        simscene.add_sim(WAVEPOOL.get(label, parms(wave_parms)))
+
     ewave_waves = ewsim.eWaveSim('thing_in_water_waves')
     ewave_waves.set('patchnxny', '[1024,512]' )
     ewave_waves.set('patchsize', '[ 40.0,20.0 ]' )
@@ -202,15 +190,45 @@ def CreateWaterSims(name, wave_parms):
 #     return camera
 
 
-def RetrieveThingInWater(f):
-    thing_in_water_path = os.path.join(ASSPATH, '{name}.{frame}.obj'.format(name=ASSNANE, frame=util.formattedFrame(f)))
+def ThingInWaterPath(f):
+    return os.path.join(ASSPATH, '{name}.{frame}.obj'.format(name=ASSNANE, frame=util.formattedFrame(f)))
     # thing_in_water_path = "../assets/toysubmarine/model/products/geom/0001/obj/lo/toysubmarine." + util.formattedFrame(f) +".obj"
+
+
+def LoadThingInWater(thing_in_water_path):
     thing_in_water = poly.Polygonal('thing_in_water')
     thing_in_water.set('objpath', thing_in_water_path)
     thing_in_water.visible = True
+    # parse the obj now, possibly on the prefetch thread
+    thing_in_water.generate_object()
     return thing_in_water
 
 
+thing_cache = ThingCache(LoadThingInWater)
+
+
+def RetrieveThingInWater(f):
+    return thing_cache.get(ThingInWaterPath(f))
+
+
+def TimingPath():
+    return os.path.join(PRODUCTSPATH, 'sim', '{name}_timing.jsonl'.format(name=PRODNAME))
+
+
+def ResultInputs(wave_parms):
+    return {'script': 'waveShape', 'wave_parms': wave_parms, 'fps': thirsty.FPS,
+            'waterthing': FilesDigest(os.path.join(ASSPATH, '{name}.*.obj'.format(name=ASSNANE)))}
+
+
+def ResultProducts(frame_list):
+    products = []
+    for f in frame_list:
+        for product in ['thing_in_water_waves', 'swell_wave', 'small_wave']:
+            name = '{product}.{f}.exr'.format(product=product, f=util.formattedFrame(f))
+            products.append((name, os.path.join(PRODUCTSPATH, 'sim', name)))
+    return products
+
+
 #
 #######################################################################################
 #######################################################################################
@@ -232,6 +250,17 @@ def sim(input_frange, wave_parms):
     import gilligan.thurston.frange as frange
     frame_range = frange.Frange(input_frange)
 
+    if RESULTCACHE is not None:
+        result_inputs = ResultInputs(wave_parms)
+        result_key = RESULTCACHE.key(result_inputs)
+        if RESULTCACHE.fetch(result_key, ResultProducts(frame_range.frames)):
+            LogIt(__file__, colors.color_yellow + "\n\tLinked all frames from result cache " + result_key + "\n" + colors.color_white)
+            endJob()
+            return
+
+    # loaded for its side effects, only runs that simulate need it
+    lazyImport.Load(updates)
+
     thirsty.F = 1
 
     simscene = CreateWaterSims('scene3', wave_parms)
@@ -261,25 +290,52 @@ def sim(input_frange, wave_parms):
 
     frame_list = frame_range.frames
 
-    for f in range(1,frame_range.end+1):
-        LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
-        thirsty.F = int(f)
-        LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N\n" + colors.color_white)
-        merged_ocean.update(timestep)
-        water_thing = RetrieveThingInWater(f)
-        ew.set('height_source_geom', water_thing)
-        ew.set('compute_height_source', True)
-        ew.update(timestep)
-        LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N   F I N I S H E D\n" + colors.color_white)
-        if f in frame_list:
-            if ew.verbose:
-                # fname = "../products/ewave_sim/" + ew.label + "." + util.formattedFrame(f) + ".exr"
-                fname = "sim/" + ew.label + "." + util.formattedFrame(f) + ".exr"
-                fname = os.path.join(PRODUCTSPATH, fname)
-                ew.write_displacement(fname)
-                sw.write_displacement(os.path.join(PRODUCTSPATH, 'sim/swell_wave.{}.exr'.format(util.formattedFrame(f))))
-                pw.write_displacement(os.path.join(PRODUCTSPATH, 'sim/small_wave.{}.exr'.format(util.formattedFrame(f))))
-
+    # the eWave needs the merged surface, so swell/small are always simulated here
+    # and only the cached frames are shared instead of written again
+    component_keys = dict()
+    if COMPONENTCACHE is not None:
+        for label, product, parms in oceanComponents.COMPONENTS:
+            component_keys[product] = oceanComponents.ComponentKey(label, parms(wave_parms), thirsty.FPS)
+            COMPONENTCACHE.prepare(component_keys[product], product)
+
+    timer = StageTimer(TimingPath())
+    writer = AsyncWriter(WRITERTHREADS, WRITEQUEUE)
+    try:
+        for f in range(1,frame_range.end+1):
+            LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
+            thirsty.F = int(f)
+            LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N\n" + colors.color_white)
+            with timer.stage('ocean_update'):
+                merged_ocean.update(timestep)
+            with timer.stage('obj_load'):
+                water_thing = RetrieveThingInWater(f)
+            if f < frame_range.end:
+                thing_cache.prefetch(ThingInWaterPath(f + 1))
+            ew.set('height_source_geom', water_thing)
+            ew.set('compute_height_source', True)
+            with timer.stage('ewave_update'):
+                ew.update(timestep)
+            LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N   F I N I S H E D\n" + colors.color_white)
+            if f in frame_list:
+                if ew.verbose:
+                    # fname = "../products/ewave_sim/" + ew.label + "." + util.formattedFrame(f) + ".exr"
+                    fname = "sim/" + ew.label + "." + util.formattedFrame(f) + ".exr"
+                    fname = os.path.join(PRODUCTSPATH, fname)
+                    with timer.stage('write_displacement'):
+                        writer.write_displacement(ew, fname)
+                        for wave, product in [(sw, 'swell_wave'), (pw, 'small_wave')]:
+                            product_path = os.path.join(PRODUCTSPATH, 'sim/{product}.{f}.exr'.format(product=product, f=util.formattedFrame(f)))
+                            if COMPONENTCACHE is None:
+                                writer.write_displacement(wave, product_path)
+                            elif os.path.isfile(COMPONENTCACHE.path(component_keys[product], product, f)):
+                                COMPONENTCACHE.link(component_keys[product], product, f, product_path)
+                            else:
+                                writer.write_displacement(wave, COMPONENTCACHE.path(component_keys[product], product, f), [product_path])
+            timer.frame(f)
+    except:
+        # land the queued frames and clean the scratch, the sim error goes on
+        writer.abort()
+        raise
 
     #
     # ###############################
@@ -559,10 +615,18 @@ def sim(input_frange, wave_parms):
     #
     #         LogIt(__file__, colors.color_yellow + "\n\n\tR E N D E R   F I N I S H E D\n" + colors.color_white)
 
+    WAVEPOOL.release(frame_range.end * timestep)
+
+    # wait for outstanding products before finishing the job
+    with timer.stage('writer_drain'):
+        writer.close()
+    timer.summary()
+    if RESULTCACHE is not None:
+        RESULTCACHE.store(result_key, ResultProducts(frame_list), result_inputs)
     endJob()
 
 
-def get_argvs():
+def get_argvs(argv=None):
     parser = argparse.ArgumentParser(description="Wave parms setting.")
     parser.add_argument('-wn', '--waterthingname', type=str, dest='wn',
                         help='Input water thing name.', default='hand02_tri')
@@ -580,28 +644,81 @@ def get_argvs():
 
     parser.add_argument('-f', '--frange', type=str, dest='f', help='Input frange.', default='1')
     parser.add_argument('-obj', '--objexport', dest='obj', action='store_true', default=False, help='Export to obj.')
-
-    args = parser.parse_args()
+    parser.add_argument('-thingcache', type=int, dest='thingcache',
+                        help='Number of loaded water thing objs to keep, 0 to disable cache and prefetch.', default=4)
+    parser.add_argument('-componentcache', type=str, dest='componentcache',
+                        help='Component cache folder shared between jobs, empty to disable.', default='')
+    parser.add_argument('-resultcache', type=str, dest='resultcache',
+                        help='Result cache folder, reuse products of runs with the same inputs. Empty to disable.', default='')
+    parser.add_argument('-resultcachesize', type=float, dest='resultcachesize',
+                        help='Result cache size cap in GB, least recently used results are evicted.', default=500.0)
+    parser.add_argument('-writers', type=int, dest='writers',
+                        help='Number of background product writer threads, 0 to write in the sim loop.', default=2)
+    parser.add_argument('-writequeue', type=int, dest='writequeue',
+                        help='Max frames waiting for the background writers.', default=8)
+    parser.add_argument('--profile-startup', dest='profilestartup', action='store_true', default=False,
+                        help='Print the import time of every module at exit.')
+    parser.add_argument('-batch', type=str, dest='batch', nargs='+', default=[],
+                        help='Run several parms configs back to back, products go to <prodpath>/<parms name>.')
+    parser.add_argument('-daemon', dest='daemon', action='store_true', default=False,
+                        help='Run in the waveShapeDaemon of this user, also when WAVESHAPE_DAEMON is set. '
+                             'Runs in this process when no daemon is running.')
+
+    args = parser.parse_args(argv)
 
     return args
 
 
-if __name__ == '__main__':
+def main(argv=None, client=True):
+    global ASSPATH, ASSNANE, PRODNAME, PRODUCTSPATH, WRITEOBJ, WRITERTHREADS, WRITEQUEUE
+    global COMPONENTCACHE, RESULTCACHE
     # cmdline parser
-    args = get_argvs()
+    args = get_argvs(argv)
+    # farm tasks never end up in a daemon they did not ask for
+    if client and (args.daemon or os.environ.get('WAVESHAPE_DAEMON')):
+        code = waveShapeDaemon.Submit('waveShape', sys.argv[1:] if argv is None else argv)
+        if code is not None:
+            sys.exit(code)
+
     ASSPATH = args.ap
     ASSNANE = args.wn
     PRODNAME = args.pn
     PRODUCTSPATH = args.pp
     WRITEOBJ = args.obj
+    WRITERTHREADS = args.writers
+    thing_cache.maxsize = args.thingcache
+    WRITEQUEUE = args.writequeue
+    # jobs of a warm worker must not see the caches of the job before
+    COMPONENTCACHE = None
+    RESULTCACHE = None
+    if args.componentcache:
+        COMPONENTCACHE = ComponentCache(args.componentcache)
+    if args.resultcache:
+        RESULTCACHE = ResultCache(args.resultcache, int(args.resultcachesize * (1 << 30)))
 
     input_frange = args.f
     wave_parms_path = args.parms
 
-    # load parms
-    wave_parms = dict()
-    with open(wave_parms_path) as jsonfile:
-        wave_parms = json.load(jsonfile)
+    if args.batch:
+        # one process for all wedges, unchanged components are not generated again
+        for wave_parms_path in args.batch:
+            PRODNAME = os.path.basename(wave_parms_path).split('.')[0]
+            PRODUCTSPATH = os.path.join(args.pp, PRODNAME)
+            if not os.path.isdir(os.path.join(PRODUCTSPATH, 'sim')):
+                os.makedirs(os.path.join(PRODUCTSPATH, 'sim'))
+            with open(wave_parms_path) as jsonfile:
+                wave_parms = json.load(jsonfile)
+            LogIt(__file__, colors.color_magenta + "\n\tB A T C H  " + PRODNAME + "\n" + colors.color_white)
+            sim(input_frange, wave_parms)
+    else:
+        # load parms
+        wave_parms = dict()
+        with open(wave_parms_path) as jsonfile:
+            wave_parms = json.load(jsonfile)
+
+        # do simulation and rendering
+        sim(input_frange, wave_parms)
+
 
-    # do simulation and rendering
-    sim(input_frange, wave_parms)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+# Warm local worker for the waveShape jobs.
+#
+# The daemon imports gilligan and the three waveShape scripts once and runs their
+# jobs one after the other in the same process. The scripts share one WavePool,
+# so the swell and small WaveSurferSim patches of recent parms stay initialised
+# between look-dev runs and a job only pays for the spectrum setup of new parms.
+#
+#     ./waveShapeDaemon.py &
+#     ./waveShape_floating.py -w ... -f 1-24 -daemon    # runs in the daemon
+#     ./waveShape_floating.py -w ... -f 1-24            # runs in this process
+#
+# The scripts submit to the daemon only with -daemon or with WAVESHAPE_DAEMON set,
+# and run locally when its socket does not answer. A job is one json line {"script", "argv", "cwd"} on the unix socket,
+# the daemon streams the job output back and ends with the exit code. Jobs can
+# also be dropped as <job>.json files into the -spool folder, output goes to
+# <job>.log and the exit code to <job>.done. Jobs run with the environment of the
+# daemon, and a job keeps running when its client goes away.
+
+import os
+import sys
+import json
+import glob
+import time
+import errno
+import signal
+import socket
+import argparse
+import traceback
+
+SCRIPTS = ['waveShape', 'waveShape_floating', 'waveShape_displacement']
+EXITMARK = '__waveShapeDaemon_exit__'
+
+
+def SocketPath():
+    # one daemon per user and workstation
+    return os.environ.get('WAVESHAPE_DAEMON', '/tmp/waveShapeDaemon.{uid}.sock'.format(uid=os.getuid()))
+
+
+def Connect(socket_path):
+    if not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        # stale socket of a daemon that is gone
+        client.close()
+        return None
+    return client
+
+
+def Submit(script, argv, socket_path=None):
+    # exit code of the job run by the daemon, None when no daemon is running
+    client = Connect(socket_path or SocketPath())
+    if client is None:
+        return None
+
+    code = 1
+    try:
+        client.sendall(json.dumps({'script': script, 'argv': argv, 'cwd': os.getcwd()}) + '\n')
+        for line in client.makefile('r', 0):
+            if line.startswith(EXITMARK):
+                code = int(line.split()[1])
+            else:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+    finally:
+        client.close()
+    return code
+
+
+class JobOutput(object):
+    # stdout/stderr of a job, the exit mark always starts on its own line
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.newline = True
+
+    def write(self, text):
+        if not text:
+            return
+        self.newline = text.endswith('\n')
+        try:
+            self.outfile.write(text)
+            self.outfile.flush()
+        except (IOError, socket.error):
+            # client went away, the job still finishes its products
+            pass
+
+    def flush(self):
+        pass
+
+    def finish(self, code):
+        self.write(('' if self.newline else '\n') + '{mark} {code}\n'.format(mark=EXITMARK, code=code))
+
+
+class Daemon(object):
+    def __init__(self, per_label):
+        import lazyImport
+        import oceanComponents
+        self.modules = dict()
+        self.pool = oceanComponents.WavePool(per_label)
+        start = time.time()
+        for name in SCRIPTS:
+            module = __import__(name)
+            # the lazy gilligan subsystems are what the daemon is warm for
+            lazyImport.Load(*module.__dict__.values())
+            module.WAVEPOOL = self.pool
+            self.modules[name] = module
+        print "waveShapeDaemon: loaded {} in {:.2f}s".format(' '.join(SCRIPTS), time.time() - start)
+        sys.stdout.flush()
+
+    def run(self, request, outfile):
+        out = JobOutput(outfile)
+        script = request.get('script')
+        if script not in self.modules:
+            out.write("waveShapeDaemon: unknown script {}\n".format(script))
+            out.finish(2)
+            return 2
+
+        start = time.time()
+        cwd = os.getcwd()
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = out
+        code = 0
+        try:
+            os.chdir(request.get('cwd', cwd))
+            self.modules[script].main(request.get('argv', []), client=False)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            if code != 0:
+                self.pool.abandon()
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(cwd)
+        out.finish(code)
+        print "waveShapeDaemon: {script} {argv} exit {code} in {wall:.2f}s".format(
+            script=script, argv=' '.join(request.get('argv', [])), code=code, wall=time.time() - start)
+        sys.stdout.flush()
+        return code
+
+    def serve_socket(self, server):
+        connection = server.accept()[0]
+        try:
+            request = json.loads(connection.makefile('r', 0).readline())
+            self.run(request, connection.makefile('w', 0))
+        except (ValueError, socket.error) as e:
+            print "waveShapeDaemon: bad request: {}".format(e)
+        finally:
+            connection.close()
+
+    def serve_spool(self, spool_path):
+        for job_path in sorted(glob.glob(os.path.join(spool_path, '*.json'))):
+            job = job_path[:-len('.json')]
+            running_path = job + '.running'
+            try:
+                # claim the job
+                os.rename(job_path, running_path)
+            except OSError:
+                continue
+            with open(running_path) as jsonfile:
+                request = json.load(jsonfile)
+            with open(job + '.log', 'w') as logfile:
+                code = self.run(request, logfile)
+            with open(job + '.done', 'w') as donefile:
+                donefile.write('{}\n'.format(code))
+            os.remove(running_path)
+
+
+def Listen(socket_path):
+    if Connect(socket_path) is not None:
+        raise RuntimeError("A waveShapeDaemon is already running on {}".format(socket_path))
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # jobs run with the rights of the daemon, only its user may submit
+    umask = os.umask(0177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(8)
+    server.settimeout(1.0)
+    return server
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser(description="Warm local worker for waveShape jobs.")
+    parser.add_argument('-socket', type=str, dest='socket', default=SocketPath(),
+                        help='Unix socket of the daemon, WAVESHAPE_DAEMON for the clients.')
+    parser.add_argument('-spool', type=str, dest='spool', default='',
+                        help='Also run <job>.json files dropped into this folder. Empty to disable.')
+    parser.add_argument('-pool', type=int, dest='pool', default=4,
+                        help='Initialised swell and small wave patches kept per component, by parms.')
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argvs()
+    daemon = Daemon(args.pool)
+    server = Listen(args.socket)
+    # kill removes the socket like ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print "waveShapeDaemon: listening on {}".format(args.socket)
+    sys.stdout.flush()
+    try:
+        while True:
+            try:
+                daemon.serve_socket(server)
+            except socket.timeout:
+                pass
+            except socket.error as e:
+                if e.errno != errno.EINTR:
+                    raise
+            if args.spool:
+                daemon.serve_spool(args.spool)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -5,25 +5,37 @@ import sys
 import math
 import argparse
 import json
+import multiprocessing
+
+import lazyImport
+lazyImport.ProfileStartup('--profile-startup' in sys.argv)
 
 # os.environ['LD_LIBRARY_PATH'] = ':/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/'
 sys.path.append('/DPA/wookie/dpa/projects/eclipse/share/')
 
-import gilligan.thurston.scene as scene
-import gilligan.thurston.sim.ewavesim as ewsim
-import gilligan.thurston.sim.wavemesh as simmesh
-import gilligan.thurston.sim.wavemerge as simmerge
-import gilligan.thurston.sim.wavesurfersim as wssim
-import gilligan.thurston.sim.updates
-import gilligan.thurston.parameter.thirsty as thirsty
-import gilligan.thurston.parameter as param
-import gilligan.thurston.util as util
+# only the gilligan subsystems a run touches are loaded, see lazyImport.py
+scene = lazyImport.LazyImport('gilligan.thurston.scene')
+ewsim = lazyImport.LazyImport('gilligan.thurston.sim.ewavesim')
+simmesh = lazyImport.LazyImport('gilligan.thurston.sim.wavemesh')
+simmerge = lazyImport.LazyImport('gilligan.thurston.sim.wavemerge')
+wssim = lazyImport.LazyImport('gilligan.thurston.sim.wavesurfersim')
+updates = lazyImport.LazyImport('gilligan.thurston.sim.updates')
+thirsty = lazyImport.LazyImport('gilligan.thurston.parameter.thirsty')
+param = lazyImport.LazyImport('gilligan.thurston.parameter')
+util = lazyImport.LazyImport('gilligan.thurston.util')
 from gilligan.thurston.logging import LogIt, beginJob, endJob
-import gilligan.thurston.geometry.polygonal as poly
-import gilligan.thurston.geometry.mesh as gmesh
-import gilligan.thurston.camera as cam
+poly = lazyImport.LazyImport('gilligan.thurston.geometry.polygonal')
+gmesh = lazyImport.LazyImport('gilligan.thurston.geometry.mesh')
+cam = lazyImport.LazyImport('gilligan.thurston.camera')
 import gilligan.thurston.colors as colors
 
+from asyncWriter import AsyncWriter
+from stageTimer import StageTimer
+import waveShapeDaemon
+from componentCache import ComponentCache
+import oceanComponents
+from resultCache import ResultCache
+
 
 # ------------------------ pre-setting -------------------------
 ASSPATH = ""
@@ -31,70 +43,34 @@ ASSNANE = ""
 PRODNAME = ""
 PRODUCTSPATH = ""
 WRITEOBJ = True
+# step the ocean through every frame instead of jumping to requested frames
+MARCH = False
+# background product writers
+WRITERTHREADS = 2
+WRITEQUEUE = 8
+# content addressed cache of swell/small wave frames shared between jobs
+COMPONENTCACHE = None
+# content addressed cache of whole job results
+RESULTCACHE = None
+# swell/small sims kept between the wedges of a batch
+WAVEPOOL = oceanComponents.WavePool()
 # -------------------------------------------------------
 
 
-def CreateWaterSims(name, wave_parms):
+def CreateWaterSims(name, wave_parms, labels):
     simscene = scene.Scene(name)
 
-    swell_waves = wssim.WaveSurferSim('swell_waves')
-    swell_waves.set('oceantype', 'str("ochi")' )
-    swell_waves.set('patchsize', '[ 4000.0, 4000.0 ]' )
-    swell_waves.set('patchnxny', '[ 2048, 2048 ]' )
-    # swell_waves.set('typicalheight', 2.0/3.7 )
-    # swell_waves.set('travel', 3.0 )
-    # swell_waves.set('align', 8.0 )
-    # swell_waves.set('direction', 90.0 )
-    # swell_waves.set('cuspscale', 0.75*4.0 )
-    # swell_waves.set('longest', 1000.0 )
-    # swell_waves.set('shortest', 4.0 )
-    # swell_waves.set('depth', 10.0 )
-    swell_waves.set('typicalheight', wave_parms.get('swell_waves').get('typicalheight') )
-    swell_waves.set('travel', wave_parms.get('swell_waves').get('travel') )
-    swell_waves.set('align', wave_parms.get('swell_waves').get('align') )
-    swell_waves.set('direction', 90.0 )
-    swell_waves.set('cuspscale', wave_parms.get('swell_waves').get('cuspscale') )
-    swell_waves.set('longest', wave_parms.get('swell_waves').get('longest') )
-    swell_waves.set('shortest', wave_parms.get('swell_waves').get('shortest') )
-    swell_waves.set('depth', wave_parms.get('swell_waves').get('depth') )
-    swell_waves.generate_object()
-    simscene.add_sim(swell_waves)
-    
-    pm_waves =  wssim.WaveSurferSim('small_waves')
-    pm_waves.set('oceantype', 'str("deep")' )
-    pm_waves.set('patchsize', '[ 30.0, 30.0 ]' )
-    pm_waves.set('patchnxny', '[ 1024, 1024 ]' )
-    pm_waves.set('typicalheight', 0.2 )
-    pm_waves.set('direction', 0.0 )
-    pm_waves.set('longest',  10.0 )
-    pm_waves.set('shortest', 0.013 )
-    pm_waves.set('cuspscale',  0.75*0.5 )
-    # pm_waves.set('cuspscale',  '0.75*0.5*(thirsty.F-1.0)/3.0' )
-    pm_waves.generate_object()
-    simscene.add_sim(pm_waves)
+    for label, product, parms in oceanComponents.COMPONENTS:
+        if label in labels:
+            simscene.add_sim(WAVEPOOL.get(label, parms(wave_parms)))
 
     return simscene
 
-#
-#######################################################################################
-#######################################################################################
-#######################################################################################
-#
-
-
-def sim(input_frange, wave_parms):
-    beginJob()
-
-    # thirsty.FPS = 30.0
-    thirsty.FPS = 24.0
-    timestep = 1.0/float( thirsty.FPS )
-
-    import gilligan.thurston.frange as frange
-    frame_range = frange.Frange(input_frange)
 
+def CreateOcean(wave_parms, labels):
     thirsty.F = 1
 
-    simscene = CreateWaterSims('water shape', wave_parms)
+    simscene = CreateWaterSims('water shape', wave_parms, labels)
     simscene.set('frame', 'thirsty.F' )
 
 
@@ -102,32 +78,179 @@ def sim(input_frange, wave_parms):
 
     # Need to assemble basewave from swell and pm
     merged_ocean = simmerge.WaveMerge('base_ocean')
-    merged_ocean.add_wave( simscene.get_sim('swell_waves') )
-    merged_ocean.add_wave( simscene.get_sim('small_waves') )
+    waves = []
+    for label, product, parms in oceanComponents.COMPONENTS:
+        if label in labels:
+            merged_ocean.add_wave( simscene.get_sim(label) )
+            waves.append((simscene.get_sim(label), product, oceanComponents.ComponentKey(label, parms(wave_parms), thirsty.FPS)))
     merged_ocean.generate_object()
     merged_ocean.verbose = True
 
-    sw = simscene.get_sim('swell_waves')
-    pw = simscene.get_sim('small_waves')
+    return merged_ocean, waves
+
+
+def ProductPath(product, f):
+    return os.path.join(PRODUCTSPATH, 'sim/{name}_{product}.{f}.exr'.format(name=PRODNAME, product=product, f=util.formattedFrame(f)))
+
+
+def TimingPath(first_frame=None):
+    # one timing file per pool worker, named by its first frame
+    if first_frame is None:
+        return os.path.join(PRODUCTSPATH, 'sim/{name}_timing.jsonl'.format(name=PRODNAME))
+    return os.path.join(PRODUCTSPATH, 'sim/{name}_timing.{f}.jsonl'.format(name=PRODNAME, f=util.formattedFrame(first_frame)))
+
+
+def ResultInputs(wave_parms):
+    return {'script': 'waveShape_displacement', 'wave_parms': wave_parms, 'fps': thirsty.FPS}
+
+
+def ResultProducts(frame_list):
+    products = []
+    for f in frame_list:
+        for label, product, parms in oceanComponents.COMPONENTS:
+            products.append(('{product}.{f}.exr'.format(product=product, f=util.formattedFrame(f)), ProductPath(product, f)))
+    return products
+
+
+def SimFrames(ocean, frame_list, timestep, writer, timer):
+    merged_ocean, waves = ocean
 
     #
     #  Update ocean to current time
     #
 
-    frame_list = frame_range.frames
+    # swell and small waves are closed form spectral surfaces without state,
+    # so the ocean can jump straight to the time of each requested frame
+    if MARCH:
+        sim_frames = range(1, max(frame_list) + 1)
+    else:
+        sim_frames = sorted(set(frame_list))
 
-    for f in range(1,frame_range.end+1):
+    current_frame = 0
+    for f in sim_frames:
         LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
         thirsty.F = int(f)
-        merged_ocean.update(timestep)
+        with timer.stage('ocean_update'):
+            merged_ocean.update(timestep * (f - current_frame))
+        current_frame = f
         if f in frame_list:
-            sw.write_displacement(os.path.join(PRODUCTSPATH, 'sim/{name}_swell_wave.{f}.exr'.format(name=PRODNAME, f=util.formattedFrame(f))))
-            pw.write_displacement(os.path.join(PRODUCTSPATH, 'sim/{name}_small_wave.{f}.exr'.format(name=PRODNAME, f=util.formattedFrame(f))))
+            with timer.stage('write_displacement'):
+                for wave, product, key in waves:
+                    if COMPONENTCACHE is None:
+                        writer.write_displacement(wave, ProductPath(product, f))
+                    else:
+                        writer.write_displacement(wave, COMPONENTCACHE.path(key, product, f), [ProductPath(product, f)])
+        timer.frame(f)
+
+    WAVEPOOL.release(current_frame * timestep)
+
 
+# ocean of a pool worker, created once per process by InitWorker
+worker_ocean = None
+
+
+def InitWorker(wave_parms, labels):
+    global worker_ocean
+    thirsty.FPS = 24.0
+    worker_ocean = CreateOcean(wave_parms, labels)
+
+
+def WorkerSimFrames(frame_list):
+    timer = StageTimer(TimingPath(frame_list[0]))
+    writer = AsyncWriter(WRITERTHREADS, WRITEQUEUE)
+    try:
+        SimFrames(worker_ocean, frame_list, 1.0/float( thirsty.FPS ), writer, timer)
+    except:
+        # land the queued frames and clean the scratch, the sim error goes on
+        writer.abort()
+        raise
+    with timer.stage('writer_drain'):
+        writer.close()
+    timer.summary()
+    return len(frame_list)
+
+
+#
+#######################################################################################
+#######################################################################################
+#######################################################################################
+#
+
+
+def sim(input_frange, wave_parms, workers=1):
+    beginJob()
+
+    # thirsty.FPS = 30.0
+    thirsty.FPS = 24.0
+    timestep = 1.0/float( thirsty.FPS )
+
+    import gilligan.thurston.frange as frange
+    frame_range = frange.Frange(input_frange)
+
+    frame_list = frame_range.frames
+
+    if RESULTCACHE is not None:
+        result_inputs = ResultInputs(wave_parms)
+        result_key = RESULTCACHE.key(result_inputs)
+        if RESULTCACHE.fetch(result_key, ResultProducts(frame_list)):
+            LogIt(__file__, colors.color_yellow + "\n\tLinked all frames from result cache " + result_key + "\n" + colors.color_white)
+            endJob()
+            return
+
+    # loaded for its side effects, only runs that simulate need it
+    lazyImport.Load(updates)
+
+    # components already in the cache are linked, only the others are simulated
+    labels = [label for label, product, parms in oceanComponents.COMPONENTS]
+    if COMPONENTCACHE is not None:
+        for label, product, parms in oceanComponents.COMPONENTS:
+            key = oceanComponents.ComponentKey(label, parms(wave_parms), thirsty.FPS)
+            if COMPONENTCACHE.complete(key, product, frame_list):
+                LogIt(__file__, "Link {label} from component cache {key}".format(label=label, key=key))
+                for f in frame_list:
+                    COMPONENTCACHE.link(key, product, f, ProductPath(product, f))
+                labels.remove(label)
+            else:
+                COMPONENTCACHE.prepare(key, product)
+
+    if not labels:
+        LogIt(__file__, "All components linked from component cache")
+    elif workers > 1:
+        # contiguous frame chunks, one per worker, each worker keeps its own ocean
+        frames = sorted(set(frame_list))
+        chunk_size = int(math.ceil(len(frames) / float(workers)))
+        chunks = [frames[i:i + chunk_size] for i in xrange(0, len(frames), chunk_size)]
+        LogIt(__file__, "Split {num} frames over {workers} workers".format(num=len(frames), workers=len(chunks)))
+        pool = multiprocessing.Pool(len(chunks), InitWorker, (wave_parms, labels))
+        try:
+            pool.map(WorkerSimFrames, chunks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        timer = StageTimer(TimingPath())
+        with timer.stage('create_ocean'):
+            ocean = CreateOcean(wave_parms, labels)
+        writer = AsyncWriter(WRITERTHREADS, WRITEQUEUE)
+        try:
+            SimFrames(ocean, frame_list, timestep, writer, timer)
+        except:
+            writer.abort()
+            raise
+        # wait for outstanding products before finishing the job
+        with timer.stage('writer_drain'):
+            writer.close()
+        timer.summary()
+
+    if RESULTCACHE is not None:
+        RESULTCACHE.store(result_key, ResultProducts(frame_list), result_inputs)
     endJob()
 
 
-def get_argvs():
+def get_argvs(argv=None):
     parser = argparse.ArgumentParser(description="Wave parms setting.")
     parser.add_argument('-wn', '--waterthingname', type=str, dest='wn',
                         help='Input water thing name.', default='hand02_tri')
@@ -145,28 +268,83 @@ def get_argvs():
 
     parser.add_argument('-f', '--frange', type=str, dest='f', help='Input frange.', default='1')
     parser.add_argument('-obj', '--objexport', dest='obj', action='store_true', default=False, help='Export to obj.')
-
-    args = parser.parse_args()
+    parser.add_argument('-march', dest='march', action='store_true', default=False,
+                        help='Update ocean through every frame from 1 instead of jumping to requested frames.')
+    parser.add_argument('-workers', '--workers', type=int, dest='workers',
+                        help='Number of local worker processes to split the frange over.', default=1)
+    parser.add_argument('-componentcache', type=str, dest='componentcache',
+                        help='Component cache folder shared between jobs, empty to disable.', default='')
+    parser.add_argument('-resultcache', type=str, dest='resultcache',
+                        help='Result cache folder, reuse products of runs with the same inputs. Empty to disable.', default='')
+    parser.add_argument('-resultcachesize', type=float, dest='resultcachesize',
+                        help='Result cache size cap in GB, least recently used results are evicted.', default=500.0)
+    parser.add_argument('-writers', type=int, dest='writers',
+                        help='Number of background product writer threads, 0 to write in the sim loop.', default=2)
+    parser.add_argument('-writequeue', type=int, dest='writequeue',
+                        help='Max frames waiting for the background writers.', default=8)
+    parser.add_argument('--profile-startup', dest='profilestartup', action='store_true', default=False,
+                        help='Print the import time of every module at exit.')
+    parser.add_argument('-batch', type=str, dest='batch', nargs='+', default=[],
+                        help='Run several parms configs back to back, products go to <prodpath>/<parms name>.')
+    parser.add_argument('-daemon', dest='daemon', action='store_true', default=False,
+                        help='Run in the waveShapeDaemon of this user, also when WAVESHAPE_DAEMON is set. '
+                             'Runs in this process when no daemon is running.')
+
+    args = parser.parse_args(argv)
 
     return args
 
 
-if __name__ == '__main__':
+def main(argv=None, client=True):
+    global ASSPATH, ASSNANE, PRODNAME, PRODUCTSPATH, WRITEOBJ, MARCH, WRITERTHREADS, WRITEQUEUE
+    global COMPONENTCACHE, RESULTCACHE
     # cmdline parser
-    args = get_argvs()
+    args = get_argvs(argv)
+    # farm tasks never end up in a daemon they did not ask for
+    if client and (args.daemon or os.environ.get('WAVESHAPE_DAEMON')):
+        code = waveShapeDaemon.Submit('waveShape_displacement', sys.argv[1:] if argv is None else argv)
+        if code is not None:
+            sys.exit(code)
+
     ASSPATH = args.ap
     ASSNANE = args.wn
     PRODNAME = args.pn
     PRODUCTSPATH = args.pp
     WRITEOBJ = args.obj
+    MARCH = args.march
+    WRITERTHREADS = args.writers
+    WRITEQUEUE = args.writequeue
+    # jobs of a warm worker must not see the caches of the job before
+    COMPONENTCACHE = None
+    RESULTCACHE = None
+    if args.componentcache:
+        COMPONENTCACHE = ComponentCache(args.componentcache)
+    if args.resultcache:
+        RESULTCACHE = ResultCache(args.resultcache, int(args.resultcachesize * (1 << 30)))
 
     input_frange = args.f
     wave_parms_path = args.parms
 
-    # load parms
-    wave_parms = dict()
-    with open(wave_parms_path) as jsonfile:
-        wave_parms = json.load(jsonfile)
+    if args.batch:
+        # one process for all wedges, unchanged components are not generated again
+        for wave_parms_path in args.batch:
+            PRODNAME = os.path.basename(wave_parms_path).split('.')[0]
+            PRODUCTSPATH = os.path.join(args.pp, PRODNAME)
+            if not os.path.isdir(os.path.join(PRODUCTSPATH, 'sim')):
+                os.makedirs(os.path.join(PRODUCTSPATH, 'sim'))
+            with open(wave_parms_path) as jsonfile:
+                wave_parms = json.load(jsonfile)
+            LogIt(__file__, colors.color_magenta + "\n\tB A T C H  " + PRODNAME + "\n" + colors.color_white)
+            sim(input_frange, wave_parms, args.workers)
+    else:
+        # load parms
+        wave_parms = dict()
+        with open(wave_parms_path) as jsonfile:
+            wave_parms = json.load(jsonfile)
+
+        # do simulation and rendering
+        sim(input_frange, wave_parms, args.workers)
+
 
-    # do simulation and rendering
-    sim(input_frange, wave_parms)
+if __name__ == '__main__':
+    main()
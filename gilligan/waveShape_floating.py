@@ -3,136 +3,397 @@
 import os
 import sys
 import math
+import time
 import argparse
 import json
+import cPickle
+from multiprocessing.pool import ThreadPool
+
+import lazyImport
+lazyImport.ProfileStartup('--profile-startup' in sys.argv)
 
 # os.environ['LD_LIBRARY_PATH'] = ':/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/'
 sys.path.append('/DPA/wookie/dpa/projects/eclipse/share/')
 
-import gilligan.thurston.scene as scene
-import gilligan.thurston.sim.ewavesim as ewsim
-import gilligan.thurston.sim.wavemesh as simmesh
-import gilligan.thurston.sim.wavemerge as simmerge
-import gilligan.thurston.sim.wavesurfersim as wssim
-import gilligan.thurston.sim.updates
-import gilligan.thurston.parameter.thirsty as thirsty
-import gilligan.thurston.parameter as param
-import gilligan.thurston.util as util
+# only the gilligan subsystems a run touches are loaded, see lazyImport.py
+scene = lazyImport.LazyImport('gilligan.thurston.scene')
+ewsim = lazyImport.LazyImport('gilligan.thurston.sim.ewavesim')
+simmesh = lazyImport.LazyImport('gilligan.thurston.sim.wavemesh')
+simmerge = lazyImport.LazyImport('gilligan.thurston.sim.wavemerge')
+wssim = lazyImport.LazyImport('gilligan.thurston.sim.wavesurfersim')
+updates = lazyImport.LazyImport('gilligan.thurston.sim.updates')
+thirsty = lazyImport.LazyImport('gilligan.thurston.parameter.thirsty')
+param = lazyImport.LazyImport('gilligan.thurston.parameter')
+util = lazyImport.LazyImport('gilligan.thurston.util')
 from gilligan.thurston.logging import LogIt, beginJob, endJob
-import gilligan.thurston.geometry.polygonal as poly
-import gilligan.thurston.geometry.mesh as gmesh
-import gilligan.thurston.camera as cam
+poly = lazyImport.LazyImport('gilligan.thurston.geometry.polygonal')
+gmesh = lazyImport.LazyImport('gilligan.thurston.geometry.mesh')
+cam = lazyImport.LazyImport('gilligan.thurston.camera')
 import gilligan.thurston.colors as colors
+# optional, vectorised water thing motion and bounds
+numpy = lazyImport.LazyImport('numpy', optional=True)
+
+from asyncWriter import AsyncWriter
+from thingCache import ThingCache, ReadPositions
+from resultCache import ResultCache, FilesDigest
+from stageTimer import StageTimer
+import oceanComponents
+import waveShapeDaemon
 
 
 # ------------------------ pre-setting -------------------------
-WATERTHING = ""
 PRODNAME = ""
 PRODUCTSPATH = ""
-LLC = ""
-PATCHSIZE = ""
-SIMSTART = 1
+# loaded objs kept per water thing
+THINGCACHE = 4
+# seconds to wait for an obj the export has not written yet, 0 to fail at once
+OBJWAIT = 0.0
+# threads stepping the eWave patches of several water things
+EWAVETHREADS = 1
 
 # to match maya displacement map setting
 swell_typicalheight_mult = 1.0
 swell_cuspscale_mult = 1.0
 # for ewave simulation
 time_offset = 0
-ewave_capillary = 0.015
-ewave_trimalpha = 0.05
 # substep
 substep = 1
+# adaptive substeps: object motion per substep is kept under CFL eWave cells, 0 for fixed substeps
+CFL = 0.0
+SUBSTEPMAX = 16
+# eWave patch fitted to the water thing: cell size in meters, 0 for the static maya patch.
+# The patch covers the path of the water thing over the whole frange and stays in place.
+# Moving it with the object would need the eWave height and velocity fields shifted by
+# the same whole cells, and gilligan has no call to translate them: a new llc alone
+# leaves the wake behind on the grid.
+TRACKCELL = 0.0
+# room for the wake around the path, in object sizes on every side
+TRACKPAD = 1.5
+# largest tracking patch in cells per side
+TRACKNXNY = 4096
+EWAVE_TRIMFRACTION = 0.1
+# checkpoint/restart
+CHECKPOINTEVERY = 0
+RESUME = False
+# background product writers
+WRITERTHREADS = 2
+WRITEQUEUE = 8
+# content addressed cache of whole job results
+RESULTCACHE = None
+# swell and small wave components kept between jobs of one process
+WAVEPOOL = oceanComponents.WavePool()
 
 # -------------------------------------------------------
 
 
-def CreateWaterSims(name, wave_parms, ewave_llc, ewave_patch_size, ambientscale, sourcescale, displacementscale):
+def CreateWaterSims(name, wave_parms, things):
     simscene = scene.Scene(name)
 
-    swell_waves = wssim.WaveSurferSim('swell_waves')
-    swell_waves.set('oceantype', 'str("ochi")' )
-    swell_waves.set('patchsize', '[ 4000.0, 4000.0 ]' )
-    swell_waves.set('patchnxny', '[ 2048, 2048 ]' )
-
     print "************************************ swell_typicalheight_mult: ", swell_typicalheight_mult, " **************************************"
 
-    swell_waves.set('typicalheight', wave_parms.get('swell_waves').get('typicalheight') * swell_typicalheight_mult)
-    swell_waves.set('cuspscale', wave_parms.get('swell_waves').get('cuspscale') * swell_cuspscale_mult)
-
-    swell_waves.set('travel', wave_parms.get('swell_waves').get('travel') )
-    swell_waves.set('align', wave_parms.get('swell_waves').get('align') )
-    swell_waves.set('direction', 90.0 )
-    swell_waves.set('longest', wave_parms.get('swell_waves').get('longest') )
-    swell_waves.set('shortest', wave_parms.get('swell_waves').get('shortest') )
-    swell_waves.set('depth', wave_parms.get('swell_waves').get('depth') )
-    swell_waves.generate_object()
-    simscene.add_sim(swell_waves)
-    
-    pm_waves =  wssim.WaveSurferSim('small_waves')
-    pm_waves.set('oceantype', 'str("deep")' )
-    pm_waves.set('patchsize', '[ 30.0, 30.0 ]' )
-    pm_waves.set('patchnxny', '[ 1024, 1024 ]' )
-    pm_waves.set('typicalheight', 0.2 )
-    pm_waves.set('direction', 0.0 )
-    pm_waves.set('longest',  10.0 )
-    pm_waves.set('shortest', 0.013 )
-    pm_waves.set('cuspscale',  0.75*0.5 )
-    # pm_waves.set('cuspscale',  '0.75*0.5*(thirsty.F-1.0)/3.0' )
-    pm_waves.generate_object()
-    simscene.add_sim(pm_waves)
-
-    ewave_waves = ewsim.eWaveSim('thing_in_water_waves')
-    # get patch nx ny according ewave patch size
-    patch_x = float(ewave_patch_size.split(',')[0].strip('['))
-    patch_y = float(ewave_patch_size.split(',')[1].strip(']'))
-    if patch_x == max(patch_x, patch_y):
-        patch_nx = 1024
-        patch_ny = int((1024 * patch_y) / patch_x)
-    else:
-        patch_ny = 1024
-        patch_nx = int((1024 * patch_x) / patch_y)
-    patchnxny = str([patch_nx, patch_ny])
+    # swell and small waves are kept between the jobs of a warm worker
+    simscene.add_sim(WAVEPOOL.get('swell_waves', oceanComponents.SwellWaveParms(wave_parms, swell_typicalheight_mult,
+                                                                                 swell_cuspscale_mult)))
+    simscene.add_sim(WAVEPOOL.get('small_waves', oceanComponents.SmallWaveParms(wave_parms)))
+
+    for thing in things:
+        simscene.add_sim(CreateEwave(thing))
+
+    return simscene
+
+
+def CreateEwave(thing):
+    # eWave patch of one water thing
+    settings = thing['settings']
+    ewave_patch_size = thing['patch']
+    ewave_waves = ewsim.eWaveSim('thing_in_water_waves_' + thing['name'])
+    patchnxny = str(EwavePatchNxNy(ewave_patch_size))
 
     ewave_waves.set('patchnxny', patchnxny )
     # ewave_waves.set('patchsize', '[ 40.0,20.0 ]' )
     ewave_waves.set('patchsize', ewave_patch_size)
     # ewave_waves.set('llc', '[ -20.0, 0.0 ]' )
-    ewave_waves.set('llc', ewave_llc)
+    ewave_waves.set('llc', thing['llc'])
     ewave_waves.set('gravity',  9.8 )
     ewave_waves.set('depth', 10.0 )
     # ewave_waves.set('displacementscale', 0.3 )
-    ewave_waves.set('displacementscale', displacementscale)
+    ewave_waves.set('displacementscale', settings['displacementscale'])
     ewave_waves.set('dohorizontal', True)
     # ewave_waves.set('sourcescale', 1.0 )
-    ewave_waves.set('sourcescale', sourcescale)
+    ewave_waves.set('sourcescale', settings['sourcescale'])
     # ewave_waves.set('ambientscale', 0.75*0.3 )
-    ewave_waves.set('ambientscale', ambientscale)
+    ewave_waves.set('ambientscale', settings['ambientscale'])
 
 ### ewave parms
     # ewave_waves.set('capillary', 0.015)
     # ewave_waves.set('trimfraction', 0.1)
     # ewave_waves.set('trimalpha', 0.05)
-    ewave_waves.set('capillary', ewave_capillary)
-    ewave_waves.set('trimfraction', 0.1)
-    ewave_waves.set('trimalpha', ewave_trimalpha)
+    ewave_waves.set('capillary', settings['capillary'])
+    ewave_waves.set('trimfraction', EWAVE_TRIMFRACTION)
+    ewave_waves.set('trimalpha', settings['trimalpha'])
 
     ewave_waves.set('compute_whitecaps', False)
 
     ewave_waves.generate_object()
-    simscene.add_sim(ewave_waves)
+    thing['ew'] = ewave_waves
+
+    return ewave_waves
+
+
+def EwavePatchNxNy(ewave_patch_size):
+    # get patch nx ny according ewave patch size
+    patch_x = float(ewave_patch_size.split(',')[0].strip('['))
+    patch_y = float(ewave_patch_size.split(',')[1].strip(']'))
+    if TRACKCELL > 0.0:
+        return [int(round(patch_x / TRACKCELL)), int(round(patch_y / TRACKCELL))]
+    if patch_x == max(patch_x, patch_y):
+        patch_nx = 1024
+        patch_ny = int((1024 * patch_y) / patch_x)
+    else:
+        patch_ny = 1024
+        patch_nx = int((1024 * patch_x) / patch_y)
+    return [patch_nx, patch_ny]
+
+
+def ThingMotion(positions, prev_positions, ewave_llc, ewave_patch_size):
+    # largest vertex move between two frames inside the eWave patch (maya x, z),
+    # parts of the object outside the patch do not drive the sim
+    llc_x = float(ewave_llc.split(',')[0].strip('['))
+    llc_y = float(ewave_llc.split(',')[1].strip(']'))
+    patch_x = float(ewave_patch_size.split(',')[0].strip('['))
+    patch_y = float(ewave_patch_size.split(',')[1].strip(']'))
+    num = min(len(positions), len(prev_positions)) / 3 * 3
+    if numpy:
+        points = numpy.asarray(positions[:num], dtype=numpy.float64).reshape(-1, 3)
+        moves = points - numpy.asarray(prev_positions[:num], dtype=numpy.float64).reshape(-1, 3)
+        inside = ((points[:, 0] >= llc_x) & (points[:, 0] <= llc_x + patch_x) &
+                  (points[:, 2] >= llc_y) & (points[:, 2] <= llc_y + patch_y))
+        if not inside.any():
+            return 0.0
+        return math.sqrt(float((moves[inside] ** 2).sum(axis=1).max()))
+    motion = 0.0
+    for i in xrange(0, num, 3):
+        x = positions[i]
+        z = positions[i + 2]
+        if llc_x <= x <= llc_x + patch_x and llc_y <= z <= llc_y + patch_y:
+            dx = x - prev_positions[i]
+            dy = positions[i + 1] - prev_positions[i + 1]
+            dz = z - prev_positions[i + 2]
+            motion = max(motion, dx * dx + dy * dy + dz * dz)
+    return math.sqrt(motion)
+
+
+def ThingBounds(positions):
+    if numpy:
+        points = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+        x0, z0 = points[:, [0, 2]].min(axis=0)
+        x1, z1 = points[:, [0, 2]].max(axis=0)
+        cx, cz = points[:, [0, 2]].mean(axis=0)
+        return float(x0), float(x1), float(z0), float(z1), float(cx), float(cz)
+    xs = positions[0::3]
+    zs = positions[2::3]
+    return min(xs), max(xs), min(zs), max(zs), sum(xs) / len(xs), sum(zs) / len(zs)
+
+
+def PathBounds(thing, frames):
+    # bounds of the water thing over all its obj frames and its largest size on one frame
+    bounds = [float('inf'), float('-inf'), float('inf'), float('-inf')]
+    size = 0.0
+    for f in frames:
+        WaitForObj(thing, f)
+        x0, x1, z0, z1, cx, cz = ThingBounds(ReadPositions(ThingInWaterPath(thing, f)))
+        bounds = [min(bounds[0], x0), max(bounds[1], x1), min(bounds[2], z0), max(bounds[3], z1)]
+        size = max(size, x1 - x0, z1 - z0)
+    return bounds, size
+
+
+def TrackingPatch(thing, bounds, size):
+    # square patch over the path with TRACKPAD object sizes of room, clear of the trim
+    # border, a power of two number of TRACKCELL cells snapped to whole cells
+    x0, x1, z0, z1 = bounds
+    side = (max(x1 - x0, z1 - z0) + 2.0 * TRACKPAD * size) / (1.0 - 2.0 * EWAVE_TRIMFRACTION)
+    cells = 1 << max(int(math.ceil(side / TRACKCELL)) - 1, 1).bit_length()
+    if cells > TRACKNXNY:
+        raise RuntimeError("Tracking patch of {name} needs {cells}x{cells} cells of {cell}m for its path, over "
+                           "the cap of {cap}, raise -trackcell or lower -trackpad".format(
+                               name=thing['name'], cells=cells, cell=TRACKCELL, cap=TRACKNXNY))
+    patch_size = cells * TRACKCELL
+    llc_x = math.floor(((x0 + x1) - patch_size) * 0.5 / TRACKCELL) * TRACKCELL
+    llc_y = math.floor(((z0 + z1) - patch_size) * 0.5 / TRACKCELL) * TRACKCELL
+    return '[{x}, {y}]'.format(x=llc_x, y=llc_y), patch_size
+
+
+def MayaPatch(ewave_llc, patch_size):
+    # -scale/-trans of the maya ewave patch, the inverse of PatchFromMaya
+    llc_x = float(ewave_llc.split(',')[0].strip('['))
+    llc_y = float(ewave_llc.split(',')[1].strip(']'))
+    return '[{s}, {s}]'.format(s=patch_size), '[{x}, {y}]'.format(x=llc_x + patch_size * 0.5,
+                                                                   y=llc_y + patch_size * 0.5)
+
+
+def PatchFromMaya(scale, trans):
+    # llc and patch size of the maya ewave patch
+    patch_scaleX = float(scale.split(',')[0].strip('['))
+    patch_scaleZ = float(scale.split(',')[1].strip(']'))
+    patch_transX = float(trans.split(',')[0].strip('['))
+    patch_transZ = float(trans.split(',')[1].strip(']'))
+    llc_x = patch_transX - (patch_scaleX * 0.5)
+    llc_y = patch_transZ - (patch_scaleZ * 0.5)
+    return '[{x}, {y}]'.format(x=llc_x, y=llc_y), scale
+
+
+def CreateThing(settings):
+    # one floating water thing, settings as in the -things json
+    thing = {'settings': settings, 'name': settings['w'].split('/')[-1], 'ew': None}
+    thing['llc'], thing['patch'] = PatchFromMaya(settings['scale'], settings['trans'])
+    thing['cache'] = ThingCache(lambda f: LoadThingInWater(thing, f), maxsize=THINGCACHE,
+                                stamp=lambda f: os.path.getmtime(ThingInWaterPath(thing, f)))
+    return thing
 
-    return simscene
 
+def ThingInWaterPath(thing, f):
+    return '{name}.{frame}.obj'.format(name=thing['settings']['w'], frame=util.formattedFrame(f))
+
+
+def LoadThingInWater(thing, f):
+    thing_in_water_path = ThingInWaterPath(thing, f)
 
-def RetrieveThingInWater(f):
-    thing_in_water_path = '{name}.{frame}.obj'.format(name=WATERTHING, frame=util.formattedFrame(f))
     thing_in_water = poly.Polygonal('thing_in_water')
     thing_in_water.set('objpath', thing_in_water_path)
     thing_in_water.visible = True
+    # parse the obj now, possibly on the prefetch thread
+    thing_in_water.generate_object()
+
+    # vertex positions for the adaptive substeps
+    if CFL > 0.0:
+        thing_in_water.positions = ReadPositions(thing_in_water_path)
 
     return thing_in_water
 
 
+def WaitForObj(thing, f):
+    # the obj export may still run next to the sim, e.g. in frameGraph.py; an obj is
+    # complete once it stopped changing for a second
+    obj_path = ThingInWaterPath(thing, f)
+    waited = 0.0
+    while OBJWAIT > 0.0:
+        try:
+            if time.time() - os.path.getmtime(obj_path) >= 1.0:
+                return
+        except OSError:
+            pass
+        if waited >= OBJWAIT:
+            raise IOError("No water thing obj {} after {:.0f}s".format(obj_path, OBJWAIT))
+        time.sleep(1.0)
+        waited += 1.0
+
+
+def RetrieveThingInWater(thing, f):
+    return thing['cache'].get(f)
+
+
+def ThingObjTime(thing, f):
+    return max(f, thing['settings']['simstart'])
+
+
+def JobName(things):
+    # name of the job wide files, the water thing name for single thing runs
+    return '{name}_ewave_{waterthing}'.format(name=PRODNAME, waterthing='_'.join(thing['name'] for thing in things))
+
+
+def ProductPath(thing, f):
+    return os.path.join(PRODUCTSPATH, 'sim/{name}_ewave_{waterthing}.{f}.exr'.format(name=PRODNAME, waterthing=thing['name'], f=util.formattedFrame(f)))
+
+
+def TimingPath(things):
+    return os.path.join(PRODUCTSPATH, 'sim/{job}_timing.jsonl'.format(job=JobName(things)))
+
+
+def ResultProducts(things, frame_list):
+    products = []
+    for thing in things:
+        products.extend(('{name}.ewave.{f}.exr'.format(name=thing['name'], f=util.formattedFrame(f)), ProductPath(thing, f))
+                        for f in frame_list)
+    return products
+
+
+def ResultInputs(sim_settings, things):
+    result_inputs = dict(sim_settings, script='waveShape_floating', fps=thirsty.FPS, waterthing=[])
+    for thing in things:
+        result_inputs['waterthing'].append(FilesDigest(thing['settings']['w'] + '.*.obj'))
+    return result_inputs
+
+
+def CheckpointPath(things, f):
+    return os.path.join(PRODUCTSPATH, 'checkpoint/{job}.{f}.ckpt'.format(job=JobName(things), f=util.formattedFrame(f)))
+
+
+def SaveCheckpoint(things, f, ocean_time, sim_key):
+    ckpt_path = CheckpointPath(things, f)
+    ckpt_dir = os.path.dirname(ckpt_path)
+    if not os.path.isdir(ckpt_dir):
+        os.makedirs(ckpt_dir)
+    ewaves = dict((thing['name'], {'ewave': thing['ew'].data_object, 'llc': thing['llc']}) for thing in things)
+    # write to tmp file first so a killed task never leaves a half written snapshot
+    tmp_path = ckpt_path + '.tmp'
+    with open(tmp_path, 'wb') as ckptfile:
+        cPickle.dump({'frame': f, 'ocean_time': ocean_time, 'sim_key': sim_key, 'ewaves': ewaves},
+                     ckptfile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, ckpt_path)
+    LogIt(__file__, colors.color_yellow + "\n\tC H E C K P O I N T  " + ckpt_path + "\n" + colors.color_white)
+
+
+def LoadCheckpoint(things, first_frame, sim_key):
+    # nearest snapshot at or before the first requested frame, skipping snapshots from other sim settings
+    ckpt_dir = os.path.dirname(CheckpointPath(things, first_frame))
+    if not os.path.isdir(ckpt_dir):
+        return None
+    prefix = os.path.basename(CheckpointPath(things, first_frame)).rsplit('.', 2)[0] + '.'
+    ckpt_frames = []
+    for ckpt_file in os.listdir(ckpt_dir):
+        if ckpt_file.startswith(prefix) and ckpt_file.endswith('.ckpt'):
+            ckpt_frame = int(ckpt_file.split('.')[-2])
+            if ckpt_frame <= first_frame:
+                ckpt_frames.append(ckpt_frame)
+
+    for ckpt_frame in sorted(ckpt_frames, reverse=True):
+        try:
+            with open(CheckpointPath(things, ckpt_frame), 'rb') as ckptfile:
+                state = cPickle.load(ckptfile)
+        except (IOError, EOFError, cPickle.UnpicklingError) as e:
+            LogIt(__file__, "Skip unreadable checkpoint {}: {}".format(CheckpointPath(things, ckpt_frame), e))
+            continue
+        if state.get('sim_key') != sim_key:
+            LogIt(__file__, "Skip checkpoint {} with different sim settings".format(CheckpointPath(things, ckpt_frame)))
+            continue
+        return state
+
+    return None
+
+
+def StepThing(thing, f, timestep, substep, cell_size):
+    # eWave of one water thing for frame f, run on the ewave threads
+    water_thing = thing['water_thing']
+    ew = thing['ew']
+    ew.set('height_source_geom', water_thing)
+    ew.set('compute_height_source', True)
+
+    frame_substep = substep
+    if CFL > 0.0:
+        motion = ThingMotion(water_thing.positions, thing['prev_thing'].positions, thing['llc'], thing['patch'])
+        frame_substep = int(math.ceil(motion / (CFL * cell_size)))
+        frame_substep = min(max(frame_substep, substep), SUBSTEPMAX)
+        LogIt(__file__, colors.color_blue + "\n\t" + thing['name'] + " motion " + str(motion) + " substeps " + str(frame_substep) + "\n" + colors.color_white)
+
+    subtimestep = float(timestep) / frame_substep
+
+    for step in xrange(frame_substep):
+        LogIt(__file__, colors.color_blue + "\n\n\tS I M U L A T I O N " + thing['name'] + " step " + str(step) + " START \n" + colors.color_white)
+        ew.update(subtimestep)
+
+    return frame_substep
+
+
 #
 #######################################################################################
 #######################################################################################
@@ -140,7 +401,7 @@ def RetrieveThingInWater(f):
 #
 
 
-def sim(input_frange, wave_parms, ewave_llc, ewave_patch_size, simstart, ambientscale, sourcescale, displacementscale, substep):
+def sim(input_frange, wave_parms, things, substep):
     beginJob()
 
     # thirsty.FPS = 30.0
@@ -150,10 +411,46 @@ def sim(input_frange, wave_parms, ewave_llc, ewave_patch_size, simstart, ambient
     import gilligan.thurston.frange as frange
     frame_range = frange.Frange(input_frange)
 
+    frame_list = frame_range.frames
+
+    if TRACKCELL > 0.0:
+        for thing in things:
+            # every obj frame the sim loop loads
+            obj_frames = sorted(set(ThingObjTime(thing, f) for f in xrange(1 + time_offset, frame_range.end + 1)))
+            bounds, size = PathBounds(thing, obj_frames)
+            thing['llc'], track_size = TrackingPatch(thing, bounds, size)
+            thing['patch'] = '[{s}, {s}]'.format(s=track_size)
+            # nothing reads the patch placement back, the maya patch has to match it
+            LogIt(__file__, colors.color_yellow + "\n\tT R A C K I N G  " + thing['name'] + " patch " + thing['patch'] + " nxny " + str(EwavePatchNxNy(thing['patch'])) + ", maya -scale {} -trans {}".format(*MayaPatch(thing['llc'], track_size)) + "\n" + colors.color_white)
+
+    # everything besides the water things that changes the ewave state
+    sim_settings = {'wave_parms': wave_parms, 'substep': substep,
+                    'height': swell_typicalheight_mult, 'cusp': swell_cuspscale_mult, 'timeoffset': time_offset,
+                    'things': [dict(thing['settings'], llc=thing['llc'], patch=thing['patch']) for thing in things]}
+    if CFL > 0.0:
+        sim_settings.update(cfl=CFL, substepmax=SUBSTEPMAX)
+    if TRACKCELL > 0.0:
+        # the patches fitted to the paths, which depend on the frange, the maya patches are not used
+        sim_settings.update(trackcell=TRACKCELL, trackpad=TRACKPAD)
+        for thing_settings in sim_settings['things']:
+            thing_settings.update(scale=None, trans=None)
+
+    # objs still being exported have no digest yet, their result is only stored
+    if RESULTCACHE is not None and OBJWAIT <= 0.0:
+        result_inputs = ResultInputs(sim_settings, things)
+        result_key = RESULTCACHE.key(result_inputs)
+        if RESULTCACHE.fetch(result_key, ResultProducts(things, frame_list)):
+            LogIt(__file__, colors.color_yellow + "\n\tLinked all frames from result cache " + result_key + "\n" + colors.color_white)
+            endJob()
+            return
+
+    # loaded for its side effects, only runs that simulate need it
+    lazyImport.Load(updates)
+
     thirsty.F = 1
     # thirsty.F = simstart
 
-    simscene = CreateWaterSims('water floating', wave_parms, ewave_llc, ewave_patch_size, ambientscale, sourcescale, displacementscale)
+    simscene = CreateWaterSims('water floating', wave_parms, things)
     simscene.set('frame', 'thirsty.F' )
 
 
@@ -166,58 +463,131 @@ def sim(input_frange, wave_parms, ewave_llc, ewave_patch_size, simstart, ambient
     merged_ocean.generate_object()
     merged_ocean.verbose = True
 
-    # update ocean for offset time
-    # current_time = simstart - 1
-    # merged_ocean.update(current_time + timestep * time_offset)
-    merged_ocean.update(timestep * time_offset)
-
-    ew = simscene.get_sim('thing_in_water_waves')
     sw = simscene.get_sim('swell_waves')
     pw = simscene.get_sim('small_waves')
-    ew.verbose = True
-    ew.set('surface_geom', merged_ocean)
+    for thing in things:
+        thing['ew'].verbose = True
 
-    #
-    #  Update ocean to current time
-    #
-
-    frame_list = frame_range.frames
-    floatingThing_name = WATERTHING.split('/')[-1]
+    # a snapshot is only reused with the same settings
+    sim_key = json.dumps(sim_settings, sort_keys=True)
 
     start_ewave_time = 1 + time_offset
     # start_ewave_time = simstart + time_offset
-    # for f in range(1, frame_range.end + 1):
-    for f in xrange(start_ewave_time, frame_range.end + 1):
-        LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
-        thirsty.F = int(f)
-        LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N\n" + colors.color_white)
-        merged_ocean.update(timestep)
-
-        obj_time = f
-        if obj_time < simstart:
-            obj_time = simstart
-
-        water_thing = RetrieveThingInWater(obj_time)
-        ew.set('height_source_geom', water_thing)
-        ew.set('compute_height_source', True)
-
-        subtimestep = float(timestep) / substep
-
-        for step in xrange(substep):
-            LogIt(__file__, colors.color_blue + "\n\n\tS I M U L A T I O N" + " step " + str(step) + " START \n" + colors.color_white)
-            ew.update(subtimestep)
-
-        LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N   F I N I S H E D\n" + colors.color_white)
-        if f in frame_list:
-            ew.write_displacement(os.path.join(PRODUCTSPATH, 'sim/{name}_ewave_{waterthing}.{f}.exr'.format(name=PRODNAME, waterthing=floatingThing_name, f=util.formattedFrame(f))))
-
+    # update ocean for offset time
+    # current_time = simstart - 1
+    # merged_ocean.update(current_time + timestep * time_offset)
+    ocean_time = timestep * time_offset
+
+    checkpoint = None
+    if RESUME:
+        checkpoint = LoadCheckpoint(things, min(frame_list), sim_key)
+    if checkpoint is not None:
+        LogIt(__file__, colors.color_yellow + "\n\tR E S U M E  from frame " + str(checkpoint['frame']) + "\n" + colors.color_white)
+        start_ewave_time = checkpoint['frame'] + 1
+        ocean_time = checkpoint['ocean_time']
+        for thing in things:
+            thing['ew'].data_object = checkpoint['ewaves'][thing['name']]['ewave']
+            thing['llc'] = checkpoint['ewaves'][thing['name']]['llc']
+            thing['ew'].set('llc', thing['llc'])
+
+    merged_ocean.update(ocean_time)
+    for thing in things:
+        thing['ew'].set('surface_geom', merged_ocean)
+
+    timer = StageTimer(TimingPath(things))
+    # eWave patches step side by side, the backend releases the GIL in update
+    ewave_pool = None
+    if EWAVETHREADS > 1 and len(things) > 1:
+        ewave_pool = ThreadPool(min(EWAVETHREADS, len(things)))
+    for thing in things:
+        # eWave grid spacing
+        thing['cell_size'] = max(float(thing['patch'].split(',')[0].strip('[')),
+                                 float(thing['patch'].split(',')[1].strip(']'))) / float(max(EwavePatchNxNy(thing['patch'])))
+
+    writer = AsyncWriter(WRITERTHREADS, WRITEQUEUE)
+    try:
+        # the snapshot frame itself may be requested
+        if checkpoint is not None and checkpoint['frame'] in frame_list:
+            for thing in things:
+                writer.write_displacement(thing['ew'], ProductPath(thing, checkpoint['frame']))
+
+        #
+        #  Update ocean to current time
+        #
+
+        # for f in range(1, frame_range.end + 1):
+        for f in xrange(start_ewave_time, frame_range.end + 1):
+            LogIt(__file__, colors.color_magenta + "\n\n********************************** F R A M E  " + str(f) + " *****************************************\n" + colors.color_white)
+            thirsty.F = int(f)
+            LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N\n" + colors.color_white)
+            # one ocean update shared by every eWave patch
+            with timer.stage('ocean_update'):
+                merged_ocean.update(timestep)
+            ocean_time += timestep
+
+            with timer.stage('obj_load'):
+                for thing in things:
+                    obj_time = ThingObjTime(thing, f)
+                    WaitForObj(thing, obj_time)
+                    thing['water_thing'] = RetrieveThingInWater(thing, obj_time)
+                    if CFL > 0.0:
+                        # before the prefetch, which get() would wait for
+                        WaitForObj(thing, ThingObjTime(thing, obj_time - 1))
+                        thing['prev_thing'] = RetrieveThingInWater(thing, ThingObjTime(thing, obj_time - 1))
+            if f < frame_range.end:
+                for thing in things:
+                    thing['cache'].prefetch(ThingObjTime(thing, f + 1))
+
+            step_args = [(thing, f, timestep, substep, thing['cell_size']) for thing in things]
+            with timer.stage('ewave_update'):
+                if ewave_pool is not None:
+                    substeps = ewave_pool.map(lambda args: StepThing(*args), step_args)
+                else:
+                    substeps = [StepThing(*args) for args in step_args]
+
+            LogIt(__file__, colors.color_yellow + "\n\n\tS I M U L A T I O N   F I N I S H E D\n" + colors.color_white)
+            if f in frame_list:
+                with timer.stage('write_displacement'):
+                    for thing in things:
+                        writer.write_displacement(thing['ew'], ProductPath(thing, f))
+            if CHECKPOINTEVERY > 0 and f % CHECKPOINTEVERY == 0:
+                with timer.stage('checkpoint'):
+                    SaveCheckpoint(things, f, ocean_time, sim_key)
+            timer.frame(f, substep=dict(zip([thing['name'] for thing in things], substeps)))
+    except:
+        # land the queued frames and clean the scratch, the sim error goes on
+        if ewave_pool is not None:
+            ewave_pool.terminate()
+        writer.abort()
+        raise
+
+    if ewave_pool is not None:
+        ewave_pool.close()
+        ewave_pool.join()
+    # wait for outstanding products before finishing the job
+    with timer.stage('writer_drain'):
+        writer.close()
+    timer.summary()
+    WAVEPOOL.release(ocean_time)
+    if RESULTCACHE is not None:
+        if OBJWAIT > 0.0:
+            result_inputs = ResultInputs(sim_settings, things)
+            result_key = RESULTCACHE.key(result_inputs)
+        RESULTCACHE.store(result_key, ResultProducts(things, frame_list), result_inputs)
     endJob()
 
 
-def get_argvs():
+def get_argvs(argv=None):
     parser = argparse.ArgumentParser(description="Wave parms setting.")
-    parser.add_argument('-w', '--waterthing', type=str, dest='w', help='Input water thing path.',
-                        default='/DPA/wookie/dpa/projects/eclipse/rnd/prods/waterThing/animfloat2_tri')
+    parser.add_argument('-w', '--waterthing', type=str, dest='w', nargs='+',
+                        help='Input water thing paths, each gets its own eWave patch with the settings below.',
+                        default=['/DPA/wookie/dpa/projects/eclipse/rnd/prods/waterThing/animfloat2_tri'])
+    parser.add_argument('-things', type=str, dest='things', default='',
+                        help='Json list of water things instead of -w, each a dict of w, scale, trans, simstart, '
+                             'ambientscale, sourcescale, displacementscale, capillary, trimalpha. '
+                             'Missing settings come from the command line.')
+    parser.add_argument('-ewavethreads', type=int, dest='ewavethreads', default=1,
+                        help='Threads stepping the eWave patches of several water things.')
     parser.add_argument('-pn', '--prodname', type=str, dest='pn',
                         help='Input products name.', default='wave_floating')
     parser.add_argument('-pp', '--prodpath', type=str, dest='pp',
@@ -244,45 +614,67 @@ def get_argvs():
     parser.add_argument('-trimalpha', type=float, dest='trimalpha', help='Input Maya ewave simulation trimalpha',
                         default=0.05)
     parser.add_argument('-simstart', type=int, dest='simstart', help='Input obj start time.', default=1)
-    parser.add_argument('-substep', type=int, dest='substep', help='Input sub step.', default=1)
+    parser.add_argument('-substep', type=int, dest='substep', help='Input sub step, the minimum with -cfl.', default=1)
+    parser.add_argument('-cfl', type=float, dest='cfl', default=0.0,
+                        help='Adaptive substeps, keep object motion per substep under cfl eWave cells. 0 for fixed -substep.')
+    parser.add_argument('-trackcell', type=float, dest='trackcell', default=0.0,
+                        help='eWave patch fitted around the path of the water thing over the frange with this cell '
+                             'size in meters, instead of the static -scale/-trans patch. 0 to disable.')
+    parser.add_argument('-trackpad', type=float, dest='trackpad', default=1.5,
+                        help='Room for the wake around the path of the tracking patch, in water thing sizes.')
+    parser.add_argument('-substepmax', type=int, dest='substepmax', help='Max adaptive sub steps.', default=16)
     parser.add_argument('-ambientscale', type=float, dest='ambientscale', help='Input ewave ambientscale.', default=0.225)
     parser.add_argument('-sourcescale', type=float, dest='sourcescale', help='Input ewave sourcescale.', default=1.0)
     parser.add_argument('-displacementscale', type=float, dest='displacementscale', help='Input ewave displacementscale.', default=0.3)
-
-    args = parser.parse_args()
+    parser.add_argument('-checkpoint', type=int, dest='checkpoint',
+                        help='Write ewave snapshot every N frames, 0 to disable.', default=0)
+    parser.add_argument('-resume', dest='resume', action='store_true', default=False,
+                        help='Resume from the nearest snapshot at or before the first frame.')
+    parser.add_argument('-objwait', type=float, dest='objwait', default=0.0,
+                        help='Seconds to wait for a water thing obj that is not exported yet, to start the sim '
+                             'while the export runs. -trackcell fits the path of every obj first, so it waits for '
+                             'all of them. 0 to fail at once.')
+    parser.add_argument('-thingcache', type=int, dest='thingcache',
+                        help='Number of loaded water thing objs to keep, 0 to disable cache and prefetch.', default=4)
+    parser.add_argument('-resultcache', type=str, dest='resultcache',
+                        help='Result cache folder, reuse products of runs with the same inputs. Empty to disable.', default='')
+    parser.add_argument('-resultcachesize', type=float, dest='resultcachesize',
+                        help='Result cache size cap in GB, least recently used results are evicted.', default=500.0)
+    parser.add_argument('-writers', type=int, dest='writers',
+                        help='Number of background product writer threads, 0 to write in the sim loop.', default=2)
+    parser.add_argument('-writequeue', type=int, dest='writequeue',
+                        help='Max frames waiting for the background writers.', default=8)
+    parser.add_argument('--profile-startup', dest='profilestartup', action='store_true', default=False,
+                        help='Print the import time of every module at exit.')
+    parser.add_argument('-daemon', dest='daemon', action='store_true', default=False,
+                        help='Run in the waveShapeDaemon of this user, also when WAVESHAPE_DAEMON is set. '
+                             'Runs in this process when no daemon is running.')
+
+    args = parser.parse_args(argv)
 
     return args
 
 
-if __name__ == '__main__':
+def main(argv=None, client=True):
+    global PRODNAME, PRODUCTSPATH, swell_cuspscale_mult, swell_typicalheight_mult, time_offset, substep
+    global CFL, SUBSTEPMAX, TRACKCELL, TRACKPAD, CHECKPOINTEVERY, RESUME, WRITERTHREADS, THINGCACHE, EWAVETHREADS
+    global RESULTCACHE, WRITEQUEUE, OBJWAIT
     # cmdline parser
-    args = get_argvs()
-    WATERTHING = args.w
+    args = get_argvs(argv)
+    # farm tasks never end up in a daemon they did not ask for
+    if client and (args.daemon or os.environ.get('WAVESHAPE_DAEMON')):
+        code = waveShapeDaemon.Submit('waveShape_floating', sys.argv[1:] if argv is None else argv)
+        if code is not None:
+            sys.exit(code)
+
     PRODNAME = args.pn
     PRODUCTSPATH = args.pp
     # LLC = args.llc
     # PATCHSIZE = args.patch
-    SIMSTART = args.simstart
 
     input_frange = args.f
     wave_parms_path = args.parms
 
-    maya_ewave_patch_scale = args.scale
-    maya_ewave_patch_trans = args.trans
-    # get llc and patch size
-    patch_scaleX = float(maya_ewave_patch_scale.split(',')[0].strip('['))
-    patch_scaleZ = float(maya_ewave_patch_scale.split(',')[1].strip(']'))
-    patch_transX = float(maya_ewave_patch_trans.split(',')[0].strip('['))
-    patch_transZ = float(maya_ewave_patch_trans.split(',')[1].strip(']'))
-    llc_x = patch_transX - (patch_scaleX * 0.5)
-    llc_y = patch_transZ - (patch_scaleZ * 0.5)
-
-    LLC = '[{x}, {y}]'.format(x=llc_x, y=llc_y)
-    PATCHSIZE = maya_ewave_patch_scale
-
-    print "ewave llc: ", LLC
-    print "ewave patch size: ", PATCHSIZE
-
     # load parms
     wave_parms = dict()
     with open(wave_parms_path) as jsonfile:
@@ -291,25 +683,64 @@ if __name__ == '__main__':
     swell_cuspscale_mult = args.cusp
     swell_typicalheight_mult = args.height
     time_offset = args.timeoffset
-    ewave_capillary = args.capillary
-    ewave_trimalpha = args.trimalpha
-    ambientscale = args.ambientscale
-    displacementscale = args.displacementscale
-    sourcescale = args.sourcescale
 
     substep = args.substep
+    CFL = args.cfl
+    SUBSTEPMAX = args.substepmax
+    TRACKCELL = args.trackcell
+    TRACKPAD = args.trackpad
+    CHECKPOINTEVERY = args.checkpoint
+    RESUME = args.resume
+    WRITERTHREADS = args.writers
+    THINGCACHE = args.thingcache
+    OBJWAIT = args.objwait
+    EWAVETHREADS = args.ewavethreads
+    # jobs of a warm worker must not see the cache of the job before
+    RESULTCACHE = None
+    if args.resultcache:
+        RESULTCACHE = ResultCache(args.resultcache, int(args.resultcachesize * (1 << 30)))
+    WRITEQUEUE = args.writequeue
+
+    # water things, entries of the -things json override the command line settings
+    thing_defaults = {'scale': args.scale, 'trans': args.trans, 'simstart': args.simstart,
+                      'ambientscale': args.ambientscale, 'sourcescale': args.sourcescale,
+                      'displacementscale': args.displacementscale, 'capillary': args.capillary,
+                      'trimalpha': args.trimalpha}
+    thing_entries = [{'w': w} for w in args.w]
+    if args.things:
+        with open(args.things) as jsonfile:
+            thing_entries = json.load(jsonfile)
+
+    things = []
+    for entry in thing_entries:
+        thing_settings = dict(thing_defaults)
+        thing_settings.update(entry)
+        things.append(CreateThing(thing_settings))
+    names = [thing['name'] for thing in things]
+    if len(set(names)) != len(names):
+        raise ValueError("Water things need distinct names, got {}".format(names))
 
     print "swell_cuspscale_mult: ", swell_cuspscale_mult
     print "swell_typicalheight_mult: ", swell_typicalheight_mult
     print "time_offset: ", time_offset
-    print "ewave_capillary: ", ewave_capillary
-    print "ewave_trimalpha: ", ewave_trimalpha
-    print "ewave_ambientscale: ", ambientscale
-    print "ewave_displacementscale: ", displacementscale
-    print "ewave_sourcescale: ", sourcescale
+    for thing in things:
+        print "water thing: ", thing['name']
+        print "\tewave llc: ", thing['llc']
+        print "\tewave patch size: ", thing['patch']
+        for key in sorted(thing['settings']):
+            print "\t{}: ".format(key), thing['settings'][key]
 
-    print "simstart: ", SIMSTART
     print "substep: ", substep
+    print "cfl: ", CFL
+    print "substep max: ", SUBSTEPMAX
+    print "tracking cell: ", TRACKCELL
+    print "ewave threads: ", EWAVETHREADS
+    print "checkpoint every: ", CHECKPOINTEVERY
+    print "resume: ", RESUME
 
     # do simulation and export displacement map for swell/small/ewave sim
-    sim(input_frange, wave_parms, LLC, PATCHSIZE, SIMSTART, ambientscale, sourcescale, displacementscale, substep)
+    sim(input_frange, wave_parms, things, substep)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,35 @@ import os
 import sys
 import time
 import datetime
+import glob
 import json
-import itertools
+import math
+import argparse
+
+import wedgeSampling
+import jobStaging
+import jobSubmit
 
 PARMSPATH = '/DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/python/parms/waveShape/swell_wedge'
 WAVESCRIPT = '/DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/python/waveShape.py'
+DISPLACEMENTSCRIPT = '/DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/python/waveShape_displacement.py'
 OUTPUTPATH = '/DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/results'
+# swell/small frames shared by all wedges, keyed by component parms
+CACHEPATH = os.path.join(OUTPUTPATH, 'component_cache')
 
 QUEUE = "brie"
+# 'cq' to submit to the farm, 'local' to run the tasks on this machine
+BACKEND = 'cq'
+# tries again after a failed submission, or a failed task on the local backend
+RETRIES = 2
+# memory of one task in GB, limits the tasks running side by side on the local backend
+LOCALMEMORY = 16.0
 frange = "1-120"
 wedge_num = 0
+# without the eWave hand, wedges run waveShape_displacement and skip simulating cached small waves
+EWAVE = True
+# wedges run back to back in one batch task, sharing the gilligan import and unchanged components
+WEDGES_PER_TASK = 4
 
 # demo value: "swell_waves": {"travel": 3.0, "cuspscale": 3.0, "depth": 10.0, "longest": 1000.0, "typicalheight": 0.5405405405405405, "align": 8.0, "shortest": 4.0}
 parm_value = [('typicalheight', [0.1, 0.9]),
@@ -23,7 +42,31 @@ parm_value = [('typicalheight', [0.1, 0.9]),
               ('longest', [10.0, 1000.0]),
               ('shortest', [0.25, 4.0]),
               ('depth', [10])]
-
+# sampled in log space by the lhs/sobol/oat samplers
+LOG_PARMS = ['longest', 'shortest']
+DEMO = {"travel": 3.0, "cuspscale": 3.0, "depth": 10.0, "longest": 1000.0, "typicalheight": 0.5405405405405405,
+        "align": 8.0, "shortest": 4.0}
+# rough cost of one wedge for -cpuhours budgets
+CPU_HOURS_PER_WEDGE = 1.5
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-sampler', choices=['grid', 'lhs', 'sobol', 'oat'], default='grid', dest='sampler',
+                        help="grid is every combination of parm_value, lhs/sobol/oat sample the range of every "
+                             "parameter with more than one value")
+    parser.add_argument('-jobs', type=int, default=0, dest='jobs', help="number of wedges to submit")
+    parser.add_argument('-cpuhours', type=float, default=0.0, dest='cpuhours',
+                        help="cpu hour budget, {} hours per wedge".format(CPU_HOURS_PER_WEDGE))
+    parser.add_argument('-seed', type=int, default=0, dest='seed', help="seed of the lhs sampler")
+    parser.add_argument('-refine', dest='refine', nargs='+', default=[],
+                        help="finished swell_wedge folders, add wedges between neighbours whose results differ most. "
+                             "Earlier passes a refine wedge refined are included")
+    args = parser.parse_args()
+    return args
+
+
+args = get_argvs()
 
 # create dir
 timestamp = time.time()
@@ -34,90 +77,175 @@ parent_path = os.path.join(OUTPUTPATH, folder_name)
 script_dir = os.path.join(parent_path, 'script')
 output_dir = os.path.join(parent_path, 'products')
 parms_dir = os.path.join(parent_path, 'parms')
-os.system("mkdir {}".format(parent_path))
-# create parms folder
-os.system("mkdir {}".format(parms_dir))
-# create script path
-os.system("mkdir {}".format(script_dir))
-# create output path and sub path
-os.system("mkdir {}".format(output_dir))
-os.system("mkdir {}/images".format(output_dir))
-os.system("mkdir {}/oceanmesh".format(output_dir))
-os.system("mkdir {}/sim".format(output_dir))
-os.system("mkdir {}/ewave_source".format(output_dir))
-# chmod
-os.system("chmod -R 770 {}".format(parent_path))
-
-
-def wave_shape_parms_generator():
-    parms_dict = dict()
-    swell_waves_dict = dict()
-    pm_waves_dict = dict()
-
-    # generate swell parms
-    parms_tuple_list = list(itertools.product(parm_value[0][1],
-                                              parm_value[1][1],
-                                              parm_value[2][1],
-                                              parm_value[3][1],
-                                              parm_value[4][1],
-                                              parm_value[5][1],
-                                              parm_value[6][1]))
-
-    i = 0
-    for parms_tuple in parms_tuple_list:
-        for id in xrange(len(parm_value)):
-            swell_waves_dict[parm_value[id][0]] = parms_tuple[id]
-
-        parms_dict['swell_waves'] = swell_waves_dict
-        parms_dict['pm_waves'] = pm_waves_dict
-
-        parms_file_path = os.path.join(parms_dir, 'swell_wedge_parms_{num}.json'.format(num=i))
-        with open(parms_file_path, 'w') as jsonfile:
-            json.dump(parms_dict, jsonfile)
-        i += 1
-
-    wedge_num = len(parms_tuple_list)
-
-
-def submit_task():
+# folders and files of the wedge, written in one pass
+stage = jobStaging.Stage(parent_path)
+# parms, script and output path, the sim folder of each wedge is staged with its parms
+for path in [parms_dir, script_dir, output_dir, CACHEPATH]:
+    stage.dir(path)
+
+
+def write_parms(samples):
+    parm_files = []
+    for i, swell_waves_dict in enumerate(samples):
+        parms_dict = {'swell_waves': swell_waves_dict, 'pm_waves': dict()}
+        parms_file_path = os.path.join(parms_dir, 'swell_wedge_parms_{num:04}.json'.format(num=i))
+        parm_files.append(stage.json(parms_file_path, parms_dict))
+        # -batch writes the products of a wedge to <prodpath>/<parms name>/sim
+        stage.dir(os.path.join(output_dir, os.path.splitext(os.path.basename(parms_file_path))[0], 'sim'))
+    return parm_files
+
+
+def exr_rms(path):
+    import OpenEXR
+    import Imath
+    exr = OpenEXR.InputFile(path)
+    pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
+    total = 0.0
+    count = 0
+    for channel in exr.header()['channels']:
+        data = exr.channel(channel, pixel_type)
+        try:
+            import numpy
+            values = numpy.frombuffer(data, dtype=numpy.float32).astype(numpy.float64)
+            total += float(numpy.dot(values, values))
+            count += values.size
+        except ImportError:
+            import array
+            values = array.array('f', data)
+            total += sum(v * v for v in values)
+            count += len(values)
+    exr.close()
+    return math.sqrt(total / max(count, 1))
+
+
+def wedge_metrics(wedge_path):
+    # parms name -> metric of one finished wedge, from <wedge>/metrics.json if given,
+    # else the rms displacement of the last swell frame of each wedge
+    metrics_path = os.path.join(wedge_path, 'metrics.json')
+    if os.path.isfile(metrics_path):
+        with open(metrics_path) as jsonfile:
+            return json.load(jsonfile)
+
+    try:
+        import OpenEXR
+    except ImportError:
+        raise RuntimeError("No {} and no OpenEXR module to measure the wedge results.".format(metrics_path))
+
+    metrics = dict()
+    for parms_path in glob.glob(os.path.join(wedge_path, 'parms', '*.json')):
+        name = os.path.splitext(os.path.basename(parms_path))[0]
+        frames = sorted(glob.glob(os.path.join(wedge_path, 'products', name, 'sim', '*swell_wave.*.exr')))
+        if frames:
+            metrics[name] = exr_rms(frames[-1])
+    return metrics
+
+
+def refine_passes(wedge_paths):
+    # the given wedges and every earlier pass they refined, from the refine field of their samples.json
+    passes = []
+    pending = list(wedge_paths)
+    while pending:
+        wedge_path = os.path.realpath(pending.pop(0))
+        if wedge_path in passes:
+            continue
+        passes.append(wedge_path)
+        samples_path = os.path.join(wedge_path, 'samples.json')
+        if os.path.isfile(samples_path):
+            with open(samples_path) as jsonfile:
+                refined = json.load(jsonfile).get('refine') or []
+            # a single folder in samples.json of older refine wedges
+            pending.extend([refined] if isinstance(refined, basestring) else refined)
+    return passes
+
+
+def refine_samples(wedge_paths, jobs):
+    # refine over the union of the wedges, not only the midpoints of the last pass
+    samples = []
+    values = []
+    passes = refine_passes(wedge_paths)
+    for wedge_path in passes:
+        metrics = wedge_metrics(wedge_path)
+        for parms_path in sorted(glob.glob(os.path.join(wedge_path, 'parms', '*.json'))):
+            name = os.path.splitext(os.path.basename(parms_path))[0]
+            if name not in metrics:
+                print "Skip {}, no result.".format(parms_path)
+                continue
+            with open(parms_path) as jsonfile:
+                samples.append(json.load(jsonfile).get('swell_waves'))
+            values.append(metrics[name])
+    if len(samples) < 2:
+        raise RuntimeError("Need at least two finished wedges in {} to refine.".format(', '.join(passes)))
+    print "Refine over {} wedges of {} passes.".format(len(samples), len(passes))
+
+    return wedgeSampling.Refine(parm_value, samples, values, jobs, LOG_PARMS)
+
+
+def wave_shape_parms_generator(sampler='grid', jobs=0, seed=0, refine=()):
+    ndim = len(wedgeSampling.Axes(parm_value))
+    if refine:
+        samples = refine_samples(refine, jobs or 2 * ndim)
+    elif sampler == 'grid':
+        samples = wedgeSampling.GridSamples(parm_value)
+        if jobs and len(samples) > jobs:
+            raise RuntimeError("Grid has {num} wedges, over the budget of {jobs}, use fewer values or another "
+                               "-sampler.".format(num=len(samples), jobs=jobs))
+    else:
+        if not jobs:
+            raise RuntimeError("Sampler {} needs a -jobs or -cpuhours budget.".format(sampler))
+        if sampler == 'lhs':
+            samples = wedgeSampling.ToSwell(parm_value, wedgeSampling.LatinHypercube(ndim, jobs, seed), LOG_PARMS)
+        elif sampler == 'sobol':
+            samples = wedgeSampling.ToSwell(parm_value, wedgeSampling.Sobol(ndim, jobs), LOG_PARMS)
+        else:
+            samples = wedgeSampling.OneAtATime(parm_value, DEMO, jobs, LOG_PARMS)
+
+    parm_files = write_parms(samples)
+    # samples of this wedge, input of a later -refine pass
+    stage.json(os.path.join(parent_path, 'samples.json'),
+               {'sampler': 'refine' if refine else sampler, 'refine': [os.path.realpath(path) for path in refine],
+                'seed': seed,
+                'parm_value': parm_value, 'samples': samples})
+
+    global wedge_num
+    wedge_num = len(samples)
+    print "Generated {} wedges.".format(wedge_num)
+    return parm_files
+
+
+def submit_task(parm_files):
     # create script
-    for root, dirs, files in os.walk(parms_dir):
-        for parm_file in files:
-            script_name = 'submit_{file}.sh'.format(file=parm_file.split('.')[0])
-            filepath = os.path.join(script_dir, script_name)
-            f = open(filepath, 'w')
-            f.write("#!/bin/bash\n")
-            f.write("export LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/\n")
-            f.write("{exe} {parm}\n".format(exe=WAVESCRIPT,
-                                            parm="-wn hand02_tri "
-                                                 "-pn {prod} "
-                                                 "-ap /DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/testAss/ "
-                                                 "-pp {prodfile} "
-                                                 "-f {frange} "
-                                                 "-p {parmfile}".format(frange=frange,
-                                                                        parmfile=os.path.join(root, parm_file),
-                                                                        prodfile=output_dir,
-                                                                        prod=parm_file.split('.')[0])))
-            f.close()
-            # chmod for script file
-            os.system("chmod 777 {file}".format(file=filepath))
+    script_paths = []
+    for pack in xrange(0, len(parm_files), WEDGES_PER_TASK):
+        pack_files = parm_files[pack:pack + WEDGES_PER_TASK]
+        script_name = 'submit_swell_wedge_pack_{num}.sh'.format(num=pack / WEDGES_PER_TASK)
+        filepath = os.path.join(script_dir, script_name)
+        script = "#!/bin/bash\n"
+        script += "export LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:/DPA/wookie/dpa/projects/eclipse/share/gilligan/3rdparty/3rdbuild/lib/\n"
+        # products of each wedge go to <prodfile>/<parms name>
+        script += "{exe} {parm}\n".format(exe=WAVESCRIPT if EWAVE else DISPLACEMENTSCRIPT,
+                                        parm="-wn hand02_tri "
+                                             "-ap /DPA/ewok/dpa/projects/eclipse/rnd/oceansurface/gilliganTest/testAss/ "
+                                             "-pp {prodfile} "
+                                             "-f {frange} "
+                                             "-componentcache {cache} "
+                                             "-batch {parmfiles}".format(frange=frange,
+                                                                         parmfiles=' '.join(pack_files),
+                                                                         prodfile=output_dir,
+                                                                         cache=CACHEPATH))
+        script_paths.append(stage.script(filepath, script))
 
     print "Scripts generation complete."
+    stage.commit(sampler=args.sampler, frange=frange, wedges=wedge_num, wedges_per_task=WEDGES_PER_TASK,
+                 ewave=EWAVE, queue=QUEUE)
     print '-' * 100
 
     # submit task
-    num = 0
-    for root, dirs, files in os.walk(script_dir):
-        for name in files:
-            script_path = os.path.join(root, name)
-            # there's .log file in the same dir
-            if script_path.endswith('.sh'):
-                print "Submit task for script {}...".format(script_path)
-                os.system("cqsubmittask {queue} {script}".format(queue=QUEUE, script=script_path))
-                num += 1
+    jobSubmit.Backend(QUEUE, BACKEND, retries=RETRIES, memory_gb=LOCALMEMORY).submit(script_paths)
 
     print "Submission complete."
-    print "\t | Task Num: ", num
+    print "\t | Task Num: ", len(script_paths)
 
-wave_shape_parms_generator()
-submit_task()
+parm_files = wave_shape_parms_generator(args.sampler,
+                                        wedgeSampling.JobBudget(args.jobs, args.cpuhours, CPU_HOURS_PER_WEDGE),
+                                        args.seed, args.refine)
+submit_task(parm_files)
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+# Samplers for the swell wedge.
+#
+# Parameters are given like parm_value in waveShape_swell_wedge.py, a list of
+# (name, values). Parameters with a single value stay fixed, the others are
+# sampled in [min(values), max(values)], in log space for the ones listed in
+# log_parms. Every sampler returns a list of swell_waves dicts.
+
+import math
+import random
+import itertools
+
+# Joe & Kuo direction numbers (s, a, m) for sobol dimensions 2..8
+SOBOL_DIRECTIONS = [(1, 0, [1]),
+                    (2, 1, [1, 3]),
+                    (3, 1, [1, 3, 1]),
+                    (3, 2, [1, 1, 1]),
+                    (4, 1, [1, 1, 3, 3]),
+                    (4, 4, [1, 3, 5, 13]),
+                    (5, 2, [1, 1, 5, 5, 17])]
+SOBOL_BITS = 30
+
+
+def Axes(parm_value):
+    return [(name, min(values), max(values)) for name, values in parm_value if len(values) > 1]
+
+
+def Fixed(parm_value):
+    return dict((name, values[0]) for name, values in parm_value if len(values) == 1)
+
+
+def ToValue(axis, u, log_parms):
+    name, low, high = axis
+    if name in log_parms and low > 0.0:
+        return math.exp(math.log(low) + u * (math.log(high) - math.log(low)))
+    return low + u * (high - low)
+
+
+def ToUnit(axis, value, log_parms):
+    name, low, high = axis
+    if high == low:
+        return 0.0
+    if name in log_parms and low > 0.0:
+        return (math.log(value) - math.log(low)) / (math.log(high) - math.log(low))
+    return (value - low) / float(high - low)
+
+
+def ToSwell(parm_value, points, log_parms):
+    axes = Axes(parm_value)
+    samples = []
+    for point in points:
+        swell = Fixed(parm_value)
+        for axis, u in zip(axes, point):
+            swell[axis[0]] = ToValue(axis, u, log_parms)
+        samples.append(swell)
+    return samples
+
+
+def JobBudget(jobs=0, cpu_hours=0.0, hours_per_wedge=1.0):
+    # the tighter of an explicit job count and a cpu hour budget, 0 means unset
+    budgets = []
+    if jobs > 0:
+        budgets.append(jobs)
+    if cpu_hours > 0.0:
+        budgets.append(max(1, int(cpu_hours / hours_per_wedge)))
+    if not budgets:
+        return 0
+    return min(budgets)
+
+
+def GridSamples(parm_value):
+    samples = []
+    for parms_tuple in itertools.product(*[values for name, values in parm_value]):
+        samples.append(dict(zip([name for name, values in parm_value], parms_tuple)))
+    return samples
+
+
+def LatinHypercube(ndim, num, seed=0):
+    rng = random.Random(seed)
+    columns = []
+    for d in xrange(ndim):
+        # one sample in each of num strata, strata shuffled per dimension
+        column = [(i + rng.random()) / num for i in xrange(num)]
+        rng.shuffle(column)
+        columns.append(column)
+    return [list(point) for point in zip(*columns)]
+
+
+def Sobol(ndim, num, skip=1):
+    if ndim > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError("Sobol sampler supports up to {} parameters".format(len(SOBOL_DIRECTIONS) + 1))
+
+    directions = []
+    for d in xrange(ndim):
+        v = [0] * (SOBOL_BITS + 1)
+        if d == 0:
+            for i in xrange(1, SOBOL_BITS + 1):
+                v[i] = 1 << (SOBOL_BITS - i)
+        else:
+            s, a, m = SOBOL_DIRECTIONS[d - 1]
+            for i in xrange(1, s + 1):
+                v[i] = m[i - 1] << (SOBOL_BITS - i)
+            for i in xrange(s + 1, SOBOL_BITS + 1):
+                v[i] = v[i - s] ^ (v[i - s] >> s)
+                for k in xrange(1, s):
+                    v[i] ^= ((a >> (s - 1 - k)) & 1) * v[i - k]
+        directions.append(v)
+
+    x = [0] * ndim
+    points = []
+    for i in xrange(num + skip):
+        if i >= skip:
+            points.append([value / float(1 << SOBOL_BITS) for value in x])
+        # gray code order, flip the direction of the lowest zero bit of i
+        c = 1
+        value = i
+        while value & 1:
+            value >>= 1
+            c += 1
+        for d in xrange(ndim):
+            x[d] ^= directions[d][c]
+    return points
+
+
+def OneAtATime(parm_value, demo, num, log_parms):
+    # demo point plus evenly spread levels of one parameter at a time
+    axes = Axes(parm_value)
+    center = Fixed(parm_value)
+    for axis in axes:
+        center[axis[0]] = demo.get(axis[0], ToValue(axis, 0.5, log_parms))
+
+    samples = [dict(center)]
+    if not axes or num <= 1:
+        return samples
+    # at most num samples, axes past the budget stay at the demo point
+    levels = max(1, (num - 1) / len(axes))
+    for axis in axes[:num - 1]:
+        for level in xrange(levels):
+            u = level / float(levels - 1) if levels > 1 else 0.5
+            sample = dict(center)
+            sample[axis[0]] = ToValue(axis, u, log_parms)
+            samples.append(sample)
+    return samples
+
+
+def Refine(parm_value, samples, metrics, num, log_parms, neighbours=0):
+    # midpoints between nearby wedges whose results differ the most
+    axes = Axes(parm_value)
+    points = [[ToUnit(axis, sample[axis[0]], log_parms) for axis in axes] for sample in samples]
+    if neighbours <= 0:
+        neighbours = 2 * len(axes)
+
+    pairs = dict()
+    for i, point in enumerate(points):
+        distances = sorted((math.sqrt(sum((a - b) ** 2 for a, b in zip(point, other))), j)
+                           for j, other in enumerate(points) if j != i)
+        for distance, j in distances[:neighbours]:
+            if distance > 0.0:
+                pairs[(min(i, j), max(i, j))] = abs(metrics[i] - metrics[j])
+
+    refined = []
+    for (i, j), difference in sorted(pairs.items(), key=lambda pair: pair[1], reverse=True):
+        if len(refined) >= num:
+            break
+        midpoint = [(a + b) * 0.5 for a, b in zip(points[i], points[j])]
+        # a midpoint an earlier pass already ran
+        if any(max(abs(a - b) for a, b in zip(midpoint, point)) < 1e-9 for point in points):
+            continue
+        if midpoint not in refined:
+            refined.append(midpoint)
+    return ToSwell(parm_value, refined, log_parms)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Frame chunks of the maya export tasks.
+#
+# A maya2016 -batch task pays for the maya startup and the scene load before it
+# bakes anything, so a task exports a chunk of frames in one session. The MEL of a
+# chunk logs the time of every frame, and the task records it next to its wall time
+# in the manifest (see exportManifest.py). The chunk size of the next export is
+# picked from those timings: large enough that the startup is a small part of a
+# task, small enough that the frames still spread over the farm.
+
+import os
+import glob
+import json
+import math
+
+import exportManifest
+
+
+def ChunkFrames(frames, size):
+    return [frames[i:i + max(size, 1)] for i in xrange(0, len(frames), max(size, 1))]
+
+
+def Median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def MeasuredCosts(prod_path):
+    # startup and per frame seconds of the finished tasks of every export of the product
+    startups = []
+    frame_costs = []
+    for timing_path in glob.glob(os.path.join(prod_path, '*', 'manifest', '*.timing.json')):
+        with open(timing_path) as jsonfile:
+            timing = json.load(jsonfile)
+        if not timing['frames']:
+            continue
+        frame_costs.extend(timing['frames'].values())
+        startups.append(max(timing['wall'] - sum(timing['frames'].values()), 0.0))
+    if not startups:
+        return None
+    return Median(startups), Median(frame_costs)
+
+
+def ChunkSize(num_frames, costs, farm_slots, overhead=0.1):
+    # one frame per task until a task of the product has been measured
+    if costs is None:
+        return 1
+    startup, per_frame = costs
+    # startup at most overhead of the task time
+    size = int(math.ceil(startup / (overhead * max(per_frame, 1e-3))))
+    # but enough tasks to fill the farm slots
+    size = min(size, int(math.ceil(num_frames / float(max(farm_slots, 1)))))
+    return max(size, 1)
+
+
+def ChunkMel(manifest_dir, frame_commands):
+    # MEL of one chunk, frame_commands is a list of (frame, MEL of the frame)
+    lines = ['float $t;',
+             'int $timing = `fopen "{path}" "w"`;'.format(
+                 path=exportManifest.FrameTimesPath(manifest_dir, frame_commands[0][0]))]
+    for f, command in frame_commands:
+        lines.append("currentTime {f};".format(f=f))   # select frame number
+        lines.append("$t = `timerX`;")
+        lines.append(command)
+        lines.append('fprint $timing ("{f} " + `timerX -startTime $t` + "\\n");'.format(f=f))
+    lines.append('fclose $timing;')
+    return '\n'.join(lines) + '\n'
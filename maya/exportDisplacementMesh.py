@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import time
 import datetime
 
+import exportManifest
+import exportChunks
+# shared helpers of the eclipse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gilligan'))
+import jobStaging
+import jobSubmit
+
 # path
 MAYAFILE = '/DPA/wookie/dpa/projects/eclipse/rnd/test/fx/oceaninteraction/maya/interaction.ma'
 OUTPUTPATH = '/DPA/wookie/dpa/projects/eclipse/rnd/prods/water_surface_obj'
@@ -14,22 +22,34 @@ end = 400
 surface_name = 'water_surface'  # object need to export
 prod_name = 'water_surface_height_0_3_400'
 QUEUE = 'brie'
+# 'cq' to submit to the farm, 'local' to run the tasks on this machine
+BACKEND = 'cq'
+# tries again after a failed submission, or a failed task on the local backend
+RETRIES = 2
+# memory of one task in GB, limits the tasks running side by side on the local backend
+LOCALMEMORY = 8.0
+# frames per maya session, 0 to pick from the measured startup and frame cost
+CHUNK = 0
+# farm slots the chunks should fill
+FARMSLOTS = 40
+# export folder of this product to bring up to date, 'latest' for the newest one,
+# empty to export every frame into a new folder
+INCREMENTAL = ''
 
 # ---------------------------------------------------------------------------------------------------------------
 
-# create prod
+# product folder
 surface_prod_path = os.path.join(OUTPUTPATH, prod_name)
-for root, dirs, files in os.walk(OUTPUTPATH):
-    if root == OUTPUTPATH:
-        if prod_name not in dirs:
-            os.system("mkdir {}".format(surface_prod_path))
-            os.system("chmod -R 770 {}".format(surface_prod_path))
-        break
 
 # create dir
-timestamp = time.time()
-dates = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d-%H-%M-%S')
-folder_name = "{name}-{date}".format(name=prod_name, date=dates)
+if INCREMENTAL == 'latest':
+    folder_name = exportManifest.LatestExport(surface_prod_path, prod_name)
+elif INCREMENTAL:
+    folder_name = INCREMENTAL
+else:
+    timestamp = time.time()
+    dates = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d-%H-%M-%S')
+    folder_name = "{name}-{date}".format(name=prod_name, date=dates)
 # create parent folder
 parent_path = os.path.join(surface_prod_path, folder_name)
 # create script path
@@ -38,73 +58,92 @@ script_dir = os.path.join(parent_path, 'script')
 output_dir = os.path.join(parent_path, 'products')
 # create mel path
 mel_dir = os.path.join(parent_path, 'mel')
-
-os.system("mkdir {}".format(parent_path))
-os.system("mkdir {}".format(mel_dir))
-os.system("mkdir {}".format(script_dir))
-os.system("mkdir {}".format(output_dir))
-# chmod
-os.system("chmod -R 770 {}".format(parent_path))
+# per frame inputs and output checksums
+manifest_dir = os.path.join(parent_path, 'manifest')
 
 # name convention
 mel_name = 'dis2Mesh_{}'.format(prod_name)
 obj_name = prod_name
 shell_name = 'batchDis2Mesh_{}'.format(prod_name)
 
+# frames to export, an incremental export skips frames with the same inputs and intact outputs
+settings = {'surface': surface_name, 'obj': obj_name}
+scene_digest = exportManifest.SceneDigest(MAYAFILE)
+frames = range(start, end + 1)
+if INCREMENTAL:
+    frames = exportManifest.StaleFrames(manifest_dir, frames, scene_digest, settings)
+    print "Incremental export of {}: {} of {} frames to export.".format(folder_name, len(frames), end - start + 1)
+
+# frames per task from the timings of earlier exports of the product
+chunk_size = CHUNK
+if chunk_size <= 0:
+    costs = exportChunks.MeasuredCosts(surface_prod_path)
+    chunk_size = exportChunks.ChunkSize(len(frames), costs, FARMSLOTS)
+    if costs is not None:
+        print "Measured maya startup {:.1f}s, {:.1f}s per frame.".format(*costs)
+chunks = exportChunks.ChunkFrames(frames, chunk_size)
+print "{} frames in {} tasks of up to {} frames.".format(len(frames), len(chunks), chunk_size)
+
+# folders and files of the run, written in one pass
+stage = jobStaging.Stage(parent_path)
+for path in [surface_prod_path, mel_dir, script_dir, output_dir, manifest_dir]:
+    stage.dir(path)
+
 
 # create MEL scripts
 def create_mel():
-    for frame_num in xrange(start, end + 1):
-        mel_file = '{mel}.{f:04}.mel'.format(mel=mel_name, f=frame_num)
+    for chunk in chunks:
+        mel_file = '{mel}.{f:04}.mel'.format(mel=mel_name, f=chunk[0])
         filepath = os.path.join(mel_dir, mel_file)
-        obj_file = '{obj}.{f:04}.obj'.format(obj=obj_name, f=frame_num)
-        objpath = os.path.join(output_dir, obj_file)
-        # write MEL script
-        f = open(filepath, 'w')
-        f.write("select {name};\n".format(name=surface_name))  # select water surface to export
-        f.write("currentTime {f};\n".format(f=frame_num))   # select frame number
-        f.write("arnoldBakeGeo -f \"{obj}\";".format(obj=objpath))  # set obj file path
-        f.close()
-        # chmod for script file
-        os.system("chmod 777 {file}".format(file=filepath))
+        frame_commands = []
+        for frame_num in chunk:
+            obj_file = '{obj}.{f:04}.obj'.format(obj=obj_name, f=frame_num)
+            objpath = os.path.join(output_dir, obj_file)
+            frame_commands.append((frame_num, "arnoldBakeGeo -f \"{obj}\";".format(obj=objpath)))  # set obj file path
+        # MEL script, one maya session bakes the whole chunk
+        mel = "select {name};\n".format(name=surface_name)  # select water surface to export
+        mel += exportChunks.ChunkMel(manifest_dir, frame_commands)
+        stage.script(filepath, mel)
 
     print "MEL scripts generation complete."
     return True
 
 
 def create_shell():
-    for frame_num in xrange(start, end + 1):
-        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=frame_num)
+    for chunk in chunks:
+        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=chunk[0])
         shell_path = os.path.join(script_dir, shell_file)
         # corresponding MEL script
-        mel_path = os.path.join(mel_dir, '{mel}.{f:04}.mel'.format(mel=mel_name, f=frame_num))
-        # write shell script
-        f = open(shell_path, 'w')
-        f.write("#!/bin/bash\n")
-        f.write("maya2016 -batch -file {maya} -script {script}".format(maya=MAYAFILE, script=mel_path))
-        f.close()
-        # chmod for script file
-        os.system("chmod 777 {file}".format(file=shell_path))
+        mel_path = os.path.join(mel_dir, '{mel}.{f:04}.mel'.format(mel=mel_name, f=chunk[0]))
+        # shell script
+        shell = "#!/bin/bash\n"
+        shell += "START=$(date +%s.%N)\n"
+        shell += "maya2016 -batch -file {maya} -script {script}\n".format(maya=MAYAFILE, script=mel_path)
+        # the task records its time and the checksums of its outputs in the manifest
+        shell += "{}\n".format(exportManifest.RecordCommand(manifest_dir, chunk))
+        stage.script(shell_path, shell)
+        for frame_num in chunk:
+            objpath = os.path.join(output_dir, '{obj}.{f:04}.obj'.format(obj=obj_name, f=frame_num))
+            stage.json(exportManifest.PendingPath(manifest_dir, frame_num), exportManifest.PendingRecord(
+                exportManifest.FrameInputs(scene_digest, frame_num, settings), objpath))
 
     print "Shell scripts generation complete."
     return True
 
 
 def submit_task():
-    num = 0
-    for frame_num in xrange(start, end + 1):
-        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=frame_num)
-        shell_path = os.path.join(script_dir, shell_file)
-        print "Submit task for script {}...".format(shell_path)
-        os.system("cqsubmittask {queue} {script}".format(queue=QUEUE, script=shell_path))
-        num += 1
+    shell_paths = [os.path.join(script_dir, '{shell}.{f:04}.sh'.format(shell=shell_name, f=chunk[0]))
+                   for chunk in chunks]
+    jobSubmit.Backend(QUEUE, BACKEND, retries=RETRIES, memory_gb=LOCALMEMORY).submit(shell_paths)
 
     print "Submission complete."
-    print "\t | Task Num: ", num
+    print "\t | Task Num: ", len(shell_paths)
 
 if __name__ == '__main__':
     # exporting things
     print "Exporting {} displacement map to mesh obj file...".format(prod_name)
     if create_mel() and create_shell():
+        stage.commit(prod=prod_name, maya=MAYAFILE, scene=scene_digest, settings=settings, frames=frames,
+                     chunk_size=chunk_size, queue=QUEUE)
         print '-' * 100
         submit_task()
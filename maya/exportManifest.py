@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Per frame manifest of the maya export products.
+#
+# The submitter writes <manifest>/<frame>.pending.json with the inputs of the frame
+# (scene digest, frame, settings) and the output path. The farm task runs
+#
+#     python exportManifest.py <manifest> <frames> -start <task start>
+#
+# after maya, which checksums the output of each frame (a file, or every file of a
+# folder) and renames its record to <manifest>/<frame>.json. An incremental export
+# only submits the frames without a record, with other inputs, or whose output is
+# missing or no longer matches its checksum. The task time and the frame times the
+# maya session logged go to <manifest>/<first frame>.timing.json, see exportChunks.py.
+# cleanFrameWetMap.py moves the output of a recorded wetmap frame from its tmp
+# folder to the promoted EXR with Promoted().
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+
+def FileDigest(path, digest=None, *digests):
+    # further digests are updated with the same blocks, the file is read once
+    digest = digest or hashlib.sha1()
+    with open(path, 'rb') as datafile:
+        for block in iter(lambda: datafile.read(1 << 20), ''):
+            digest.update(block)
+            for other in digests:
+                other.update(block)
+    return digest
+
+
+def OutputChecksum(path, file_digests=None):
+    # None when the output is missing, or an empty folder, file_digests gets the
+    # checksum of each file of a folder
+    if os.path.isfile(path):
+        return FileDigest(path).hexdigest()
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha1()
+    files = sorted(os.listdir(path))
+    for name in files:
+        digest.update(name)
+        if file_digests is None:
+            FileDigest(os.path.join(path, name), digest)
+        else:
+            file_digests[name] = FileDigest(os.path.join(path, name), hashlib.sha1(), digest).hexdigest()
+    return digest.hexdigest() if files else None
+
+
+def SceneDigest(maya_file):
+    # the .ma itself, referenced files are not followed
+    return FileDigest(maya_file).hexdigest()
+
+
+def LatestExport(prod_path, prod_name):
+    # export folders are <prod_name>-<date>, the date sorts as text
+    folders = [name for name in os.listdir(prod_path)
+               if name.startswith(prod_name + '-') and os.path.isdir(os.path.join(prod_path, name))]
+    if not folders:
+        raise RuntimeError("No export of {} in {} to update".format(prod_name, prod_path))
+    return max(folders)
+
+
+def RecordPath(manifest_dir, f):
+    return os.path.join(manifest_dir, '{f:04}.json'.format(f=f))
+
+
+def PendingPath(manifest_dir, f):
+    return os.path.join(manifest_dir, '{f:04}.pending.json'.format(f=f))
+
+
+def FrameInputs(scene_digest, f, settings):
+    return {'scene': scene_digest, 'frame': f, 'settings': settings}
+
+
+def PendingRecord(inputs, output):
+    return {'inputs': inputs, 'output': output}
+
+
+def WritePending(manifest_dir, f, inputs, output):
+    with open(PendingPath(manifest_dir, f), 'w') as jsonfile:
+        json.dump(PendingRecord(inputs, output), jsonfile, indent=1, sort_keys=True)
+
+
+def Record(manifest_dir, f):
+    # run by the farm task once maya is done, fails when maya wrote nothing
+    with open(PendingPath(manifest_dir, f)) as jsonfile:
+        record = json.load(jsonfile)
+    record['files'] = dict()
+    record['checksum'] = OutputChecksum(record['output'], record['files'])
+    if record['checksum'] is None:
+        raise RuntimeError("No output {} for frame {}".format(record['output'], f))
+    WriteRecord(manifest_dir, f, record)
+    os.remove(PendingPath(manifest_dir, f))
+
+
+def WriteRecord(manifest_dir, f, record):
+    tmp_path = RecordPath(manifest_dir, f) + '.tmp'
+    with open(tmp_path, 'w') as jsonfile:
+        json.dump(record, jsonfile, indent=1, sort_keys=True)
+    os.rename(tmp_path, RecordPath(manifest_dir, f))
+
+
+def Promoted(manifest_dir, f, tmp_file, output):
+    # the recorded output tmp_file of frame f now lives at output, a file with the same content
+    with open(RecordPath(manifest_dir, f)) as jsonfile:
+        record = json.load(jsonfile)
+    if record['output'] != os.path.dirname(tmp_file):
+        # promoted before, or the record of another output
+        return
+    checksum = record.get('files', {}).get(os.path.basename(tmp_file))
+    record['output'] = output
+    record['checksum'] = checksum or OutputChecksum(output)
+    record['files'] = dict()
+    WriteRecord(manifest_dir, f, record)
+
+
+def StaleFrames(manifest_dir, frames, scene_digest, settings):
+    stale = []
+    for f in frames:
+        try:
+            with open(RecordPath(manifest_dir, f)) as jsonfile:
+                record = json.load(jsonfile)
+        except (IOError, ValueError):
+            stale.append(f)
+            continue
+        if record.get('inputs') != FrameInputs(scene_digest, f, settings):
+            stale.append(f)
+        elif OutputChecksum(record['output']) != record.get('checksum'):
+            # missing or corrupt output
+            stale.append(f)
+    return stale
+
+
+def FrameTimesPath(manifest_dir, first_frame):
+    # "<frame> <seconds>" lines written by the maya session
+    return os.path.join(manifest_dir, '{f:04}.frames.txt'.format(f=first_frame))
+
+
+def TimingPath(manifest_dir, first_frame):
+    return os.path.join(manifest_dir, '{f:04}.timing.json'.format(f=first_frame))
+
+
+def RecordTiming(manifest_dir, frames, task_start):
+    frame_times = dict()
+    if os.path.isfile(FrameTimesPath(manifest_dir, frames[0])):
+        with open(FrameTimesPath(manifest_dir, frames[0])) as timesfile:
+            for line in timesfile:
+                if line.strip():
+                    f, seconds = line.split()
+                    frame_times[f] = float(seconds)
+        os.remove(FrameTimesPath(manifest_dir, frames[0]))
+    with open(TimingPath(manifest_dir, frames[0]), 'w') as jsonfile:
+        json.dump({'wall': time.time() - task_start, 'frames': frame_times}, jsonfile, indent=1, sort_keys=True)
+
+
+def RecordCommand(manifest_dir, frames):
+    # shell line of the farm task that records its frames, START is set by the task
+    return "python {script} {manifest} {frames} -start $START".format(
+        script=os.path.abspath(__file__).replace('.pyc', '.py'), manifest=manifest_dir,
+        frames=' '.join(str(f) for f in frames))
+
+
+def get_argvs():
+    parser = argparse.ArgumentParser(description="Record the outputs of a maya export task.")
+    parser.add_argument('manifest', type=str, help='Manifest folder of the export.')
+    parser.add_argument('frames', type=int, nargs='+', help='Frames of the task.')
+    parser.add_argument('-start', type=float, dest='start', default=0.0, help='Task start time, 0 for no timing.')
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = get_argvs()
+    if args.start > 0.0:
+        RecordTiming(args.manifest, args.frames, args.start)
+    failed = []
+    for f in args.frames:
+        try:
+            Record(args.manifest, f)
+        except (IOError, RuntimeError) as e:
+            print e
+            failed.append(f)
+    if failed:
+        sys.exit("Frames without output: {}".format(' '.join(str(f) for f in failed)))
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 # nuke10 -F 3 -x export_wetmap.nk
+# nuke10 -F 1-30 -m 16 -x export_wetmap.nk
 
 import os
+import sys
 import time
 import datetime
 
+# shared helpers of the eclipse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gilligan'))
+import jobStaging
+import jobSubmit
+
 # path
 NUKEFILE = '/DPA/ewok/dpa/projects/eclipse/rnd/prods/wetMap/float_1/export_wetmap_float_1.nk'
 OUTPUTPATH = '/DPA/ewok/dpa/projects/eclipse/rnd/prods/wetMap/float_1'
@@ -14,6 +21,19 @@ start = 1
 end = 120
 prod_name = 'nukeQueue-{}'.format(NUKEFILE.split('/')[-1].split('.')[0])
 QUEUE = 'cheezwhiz'
+# 'cq' to submit to the farm, 'local' to run the tasks on this machine
+BACKEND = 'cq'
+# tries again after a failed submission, or a failed task on the local backend
+RETRIES = 2
+# memory of one task in GB, limits the tasks running side by side on the local backend
+LOCALMEMORY = 4.0
+# frames per nuke task, the .nk is loaded once per task
+CHUNK = 30
+# render threads per task (nuke -m), the cores of a farm node to give each task the node, 0 for the nuke
+# default of every core (one task at a time on the local backend)
+THREADS = 0
+# only these frames, e.g. [17, 42] to render failed frames again, empty for start to end
+FRAMES = []
 
 # ---------------------------------------------------------------------------------------------------------------
 
@@ -21,45 +41,56 @@ QUEUE = 'cheezwhiz'
 timestamp = time.time()
 dates = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d-%H-%M-%S')
 script_dir = os.path.join(OUTPUTPATH, "{name}-{date}".format(name=prod_name, date=dates))
-# mkdir
-os.system("mkdir {}".format(script_dir))
-# chmod
-os.system("chmod -R 770 {}".format(script_dir))
+# folder and scripts of the run, written in one pass
+stage = jobStaging.Stage(script_dir)
 # name convention
 shell_name = prod_name
 
+# frame chunks of the tasks
+frames = sorted(FRAMES) or range(start, end + 1)
+chunks = [frames[i:i + max(CHUNK, 1)] for i in xrange(0, len(frames), max(CHUNK, 1))]
+
+
+def frame_ranges(chunk):
+    # -F of each run of consecutive frames in the chunk
+    ranges = []
+    for frame_num in chunk:
+        if ranges and frame_num == ranges[-1][1] + 1:
+            ranges[-1][1] = frame_num
+        else:
+            ranges.append([frame_num, frame_num])
+    return ' '.join('-F {}'.format(a if a == b else '{}-{}'.format(a, b)) for a, b in ranges)
+
 
 def create_shell():
-    for frame_num in xrange(start, end + 1):
-        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=frame_num)
+    for chunk in chunks:
+        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=chunk[0])
         shell_path = os.path.join(script_dir, shell_file)
-        # write shell script
-        f = open(shell_path, 'w')
-        f.write("#!/bin/bash\n")
-        f.write("nuke10 -F {frame} -x {nuke}".format(frame=frame_num, nuke=NUKEFILE))
-        f.close()
-        # chmod for script file
-        os.system("chmod 777 {file}".format(file=shell_path))
+        # shell script
+        options = frame_ranges(chunk)
+        if THREADS > 0:
+            options += " -m {}".format(THREADS)
+        # no --cont: nuke exits 0 with it when frames fail, a bad frame has to fail the
+        # task so the backend retries and reports it
+        stage.script(shell_path, "#!/bin/bash\nnuke10 {options} -x {nuke}".format(options=options, nuke=NUKEFILE))
 
     print "Shell scripts generation complete."
     return True
 
 
 def submit_task():
-    num = 0
-    for frame_num in xrange(start, end + 1):
-        shell_file = '{shell}.{f:04}.sh'.format(shell=shell_name, f=frame_num)
-        shell_path = os.path.join(script_dir, shell_file)
-        print "Submit task for script {}...".format(shell_path)
-        os.system("cqsubmittask {queue} {script}".format(queue=QUEUE, script=shell_path))
-        num += 1
+    shell_paths = [os.path.join(script_dir, '{shell}.{f:04}.sh'.format(shell=shell_name, f=chunk[0]))
+                   for chunk in chunks]
+    backend = jobSubmit.Backend(QUEUE, BACKEND, retries=RETRIES, cores_per_task=THREADS, memory_gb=LOCALMEMORY)
+    backend.submit(shell_paths)
 
     print "Submission complete."
-    print "\t | Task Num: ", num
+    print "\t | Task Num: ", len(shell_paths)
 
 if __name__ == '__main__':
     # exporting things
     print "Nuke Batch render {}".format(prod_name)
     if create_shell():
+        stage.commit(nuke=NUKEFILE, frames=frames, chunk_size=CHUNK, threads=THREADS, queue=QUEUE)
         print '-' * 100
         submit_task()